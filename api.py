@@ -1,86 +1,28 @@
 import logging
-from typing import List, Optional
+from dataclasses import asdict
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
 import pdf_generator
+import customer_store
+from log_utils import setup_queue_logging
+from quote_models import QuoteDraft
 import os
 import sys
 import json
 
 
-# --- Pydantic Models ---
-class LineItem(BaseModel):
-    qty: int
-    line_description: str
-    unit_price: float
-    gl_code: str
-
-
-class ServiceLineItem(BaseModel):
-    qty: int
-    line_description: str
-    unit_price: float
-    gl_code: str
-
-
-class QuotationLineItem(BaseModel):
-    qty: int
-    line_description: str
-    unit_price: float
-    gl_code: str
-
-
-class PaymentPhase(BaseModel):
-    name: str
-    amount: float
-    remarks: Optional[str] = None
-
-
-class MultiLineQuotationData(BaseModel):
-    type: str
-    cust_code: str
-    cust_name: str
-    company_address: Optional[str] = None
-    cust_contact: Optional[str] = None
-    truck_number: str
-    body: Optional[str] = None
-    issuing_company: str
-    doc_no: str
-    description: str
-    salesperson: Optional[str] = None
-    line_items: List[LineItem] = []
-    service_line_items: List[LineItem] = []
-    excluded_line_items: List[LineItem] = []
-    included_services: List[str] = []
-    payment_phases: List[PaymentPhase] = []
-    total_amount: float
-    is_proforma: bool = False
-
-    # Rental specific fields
-    main_rental_item: Optional[LineItem] = None
-    rental_period_type: Optional[str] = None
-    contract_period: Optional[str] = None
-    rental_start_date: Optional[str] = None
-    rental_end_date: Optional[str] = None
-    rental_amount: Optional[float] = None
-    deposit_condition: Optional[str] = None
-    deposit_amount: Optional[float] = None
-    security_deposit: Optional[float] = None
-    upfront_rental: Optional[float] = None
-    road_tax_amount: Optional[float] = None
-    insurance_amount: Optional[float] = None
-    sticker_amount: Optional[float] = None
-    agreement_fee: Optional[float] = None
-    selected_equipment: Optional[List[str]] = None
+# --- Request Models ---
+# The request body is the QuoteDraft the bot builds; FastAPI validates it
+# through pydantic without a separate model definition.
+MultiLineQuotationData = QuoteDraft
 
 
 # --- FastAPI App ---
 app = FastAPI()
 
 # --- Logging Setup ---
-logging.basicConfig(level=logging.INFO)
+setup_queue_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -101,10 +43,11 @@ async def generate_quotation_pdf(quote_data: MultiLineQuotationData):
     """
     try:
         logger.info(f"Received data for PDF generation: {quote_data.doc_no}")
-        data_dict = quote_data.model_dump()
+        data_dict = asdict(quote_data)
         file_path = pdf_generator.generate_pdf_from_data(data_dict)
         if file_path:
             logger.info(f"Successfully generated PDF: {file_path}")
+            _remember_customer(quote_data)
             return {"success": True, "file_path": file_path}
         else:
             logger.error("PDF generation failed, function returned None.")
@@ -112,3 +55,26 @@ async def generate_quotation_pdf(quote_data: MultiLineQuotationData):
     except Exception as e:
         logger.exception("An error occurred during PDF generation.")
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {e}")
+
+
+def _remember_customer(quote_data: MultiLineQuotationData) -> None:
+    """Adds the quoted customer to the customer store for future lookups."""
+    if quote_data.cust_name.strip().upper() in ["", "N/A", "CASH SALE"]:
+        return
+    try:
+        customer_store.get_store().upsert(
+            quote_data.cust_name, quote_data.company_address, quote_data.cust_contact
+        )
+    except Exception:
+        logger.exception(f"Could not save customer '{quote_data.cust_name}'.")
+
+
+@app.get("/api/search_customer/")
+def search_customer(name: str, limit: int = 5):
+    """
+    Returns customers whose names fuzzily match `name`, best match first,
+    keyed by the stored customer name.
+    """
+    matches = customer_store.get_store().search(name, limit=limit)
+    logger.info(f"Customer search for '{name}' returned {len(matches)} match(es).")
+    return {match["name"]: match for match in matches}
@@ -1,21 +1,24 @@
-import google.generativeai as genai
-import os
+import asyncio
 import logging
 import PIL.Image
 import json
 
+from .ai_backend import GEMINI_MODEL, get_backend
+from .extraction_cache import cached_extraction, image_key, text_key
+from .imaging import prepare_image
+from .limiter import gemini_limiter
+from .retry import call_with_retry
+from quote_models import LINE_ITEMS_SCHEMA, QUOTE_DETAILS_SCHEMA
+
 logger = logging.getLogger(__name__)
 
-# Configure the Gemini API key
-try:
-    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-except KeyError:
-    logger.error("GEMINI_API_KEY environment variable not set.")
-    # You might want to handle this more gracefully, e.g., by disabling AI features
-    # and logging a clear error message for the user.
-    raise ImportError("GEMINI_API_KEY not set, cannot use AI features.")
+
+def _json_config(schema: dict) -> dict:
+    """Generation settings asking for JSON that matches schema."""
+    return {"response_mime_type": "application/json", "response_schema": schema}
 
 
+@cached_extraction("image", image_key, QUOTE_DETAILS_SCHEMA, GEMINI_MODEL)
 async def extract_details_from_image(image: PIL.Image.Image) -> dict:
     """
     Uses the Gemini API to extract details directly from an image.
@@ -28,7 +31,9 @@ async def extract_details_from_image(image: PIL.Image.Image) -> dict:
     Returns:
         A dictionary of extracted details.
     """
-    model = genai.GenerativeModel("gemini-2.5-flash")
+    backend = get_backend()
+    # Downscaled and re-encoded off the event loop; sent as inline JPEG/WebP.
+    image_blob = await asyncio.to_thread(prepare_image, image)
     prompt = """
     Analyze this image and extract specific details into a JSON object. 
     The image might be a document (invoice/quote), a photo of a vehicle (truck/lorry), or a business card.
@@ -73,42 +78,21 @@ async def extract_details_from_image(image: PIL.Image.Image) -> dict:
     STRICTLY RETURN ONLY JSON. NO MARKDOWN. NO OTHER TEXT.
     """
 
-    for attempt in range(3):
-        try:
-            response = await model.generate_content_async([prompt, image])
-            text_response = response.text
-
-            # Cleanup potential markdown
-            cleaned_response = (
-                text_response.strip().replace("```json", "").replace("```", "").strip()
+    async def attempt():
+        async with gemini_limiter.slot():
+            text = await backend.generate(
+                [prompt, image_blob], **_json_config(QUOTE_DETAILS_SCHEMA)
             )
+        return json.loads(text)
 
-            try:
-                return json.loads(cleaned_response)
-            except json.JSONDecodeError:
-                # Fallback: Try to find the JSON object boundaries
-                start = cleaned_response.find("{")
-                end = cleaned_response.rfind("}") + 1
-                if start != -1 and end != 0 and end > start:
-                    json_str = cleaned_response[start:end]
-                    try:
-                        return json.loads(json_str)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Fallback JSON parsing also failed: {e}")
-                        raise
-                else:
-                    raise
-
-        except (json.JSONDecodeError, Exception) as e:
-            logger.warning(f"Attempt {attempt + 1} failed (Image Extraction): {e}")
-            if attempt == 2:
-                logger.error(f"Error calling Gemini API (Image) after 3 attempts: {e}")
-                if "response" in locals():
-                    logger.error(f"Final Raw API response: {response.text}")
-                return {}
-    return {}
+    try:
+        return await call_with_retry("ai.extract_image", attempt)
+    except Exception as e:
+        logger.error(f"Error calling Gemini API (Image): {e}")
+        return {}
 
 
+@cached_extraction("text", text_key, QUOTE_DETAILS_SCHEMA, GEMINI_MODEL)
 async def extract_details_from_text(text: str) -> dict:
     """
     Uses the Gemini API to extract details from the user's text.
@@ -119,7 +103,7 @@ async def extract_details_from_text(text: str) -> dict:
     Returns:
         A dictionary of extracted details.
     """
-    model = genai.GenerativeModel("gemini-2.5-flash")
+    backend = get_backend()
     prompt = f"""
     Extract the following details from the text below:
     - doc_type (infer if it is 'sales', 'rental', or 'refurbish' based on keywords like 'rental', 'hire', 'sale', 'repair'. Default to null if unsure.)
@@ -150,42 +134,18 @@ async def extract_details_from_text(text: str) -> dict:
     STRICTLY RETURN ONLY JSON. NO MARKDOWN. NO OTHER TEXT.
     """
 
-    for attempt in range(3):
-        try:
-            response = await model.generate_content_async(prompt)
-            text_response = response.text
-
-            # Cleanup potential markdown
-            cleaned_response = (
-                text_response.strip().replace("```json", "").replace("```", "").strip()
+    async def attempt():
+        async with gemini_limiter.slot():
+            text = await backend.generate(
+                prompt, **_json_config(QUOTE_DETAILS_SCHEMA)
             )
+        return json.loads(text)
 
-            try:
-                return json.loads(cleaned_response)
-            except json.JSONDecodeError:
-                # Fallback: Try to find the JSON object boundaries
-                start = cleaned_response.find("{")
-                end = cleaned_response.rfind("}") + 1
-                if start != -1 and end != 0 and end > start:
-                    json_str = cleaned_response[start:end]
-                    try:
-                        return json.loads(json_str)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Fallback JSON parsing also failed: {e}")
-                        raise
-                else:
-                    raise
-
-        except (json.JSONDecodeError, Exception) as e:
-            logger.warning(f"Attempt {attempt + 1} failed: {e}")
-            if attempt == 2:
-                logger.error(
-                    f"Error calling Gemini API or parsing JSON after 3 attempts: {e}"
-                )
-                if "response" in locals():
-                    logger.error(f"Final Raw API response: {response.text}")
-                return {}
-    return {}
+    try:
+        return await call_with_retry("ai.extract_text", attempt)
+    except Exception as e:
+        logger.error(f"Error calling Gemini API or parsing JSON: {e}")
+        return {}
 
 
 async def extract_text_from_image(image: PIL.Image.Image) -> str:
@@ -198,17 +158,23 @@ async def extract_text_from_image(image: PIL.Image.Image) -> str:
     Returns:
         The extracted text.
     """
-    model = genai.GenerativeModel("gemini-2.5-flash")
+    backend = get_backend()
     try:
-        response = await model.generate_content_async(
-            ["Transcribe all text from this image.", image]
-        )
-        return response.text
+        image_blob = await asyncio.to_thread(prepare_image, image)
+
+        async def attempt():
+            async with gemini_limiter.slot():
+                return await backend.generate(
+                    ["Transcribe all text from this image.", image_blob]
+                )
+
+        return await call_with_retry("ai.transcribe_image", attempt)
     except Exception as e:
         logger.error(f"Error calling Gemini API: {e}")
         return ""
 
 
+@cached_extraction("line_items", text_key, LINE_ITEMS_SCHEMA, GEMINI_MODEL)
 async def extract_line_items_from_text(text: str) -> list:
     """
     Uses the Gemini API to extract line items from the user's text.
@@ -219,7 +185,7 @@ async def extract_line_items_from_text(text: str) -> list:
     Returns:
         A list of dictionaries, where each dictionary is a line item.
     """
-    model = genai.GenerativeModel("gemini-2.5-flash")
+    backend = get_backend()
     prompt = f"""
     Extract the line items from the text below. Each item should have a 'line_description', 'qty', and 'unit_price'.
     If quantity is not mentioned, assume it is 1.
@@ -240,39 +206,13 @@ async def extract_line_items_from_text(text: str) -> list:
     STRICTLY RETURN ONLY JSON. NO MARKDOWN. NO OTHER TEXT.
     """
 
-    for attempt in range(3):
-        try:
-            response = await model.generate_content_async(prompt)
-            text_response = response.text
-
-            # Cleanup potential markdown
-            cleaned_response = (
-                text_response.strip().replace("```json", "").replace("```", "").strip()
-            )
+    async def attempt():
+        async with gemini_limiter.slot():
+            text = await backend.generate(prompt, **_json_config(LINE_ITEMS_SCHEMA))
+        return json.loads(text)
 
-            try:
-                return json.loads(cleaned_response)
-            except json.JSONDecodeError:
-                # Fallback: Try to find the JSON list boundaries
-                start = cleaned_response.find("[")
-                end = cleaned_response.rfind("]") + 1
-                if start != -1 and end != 0 and end > start:
-                    json_str = cleaned_response[start:end]
-                    try:
-                        return json.loads(json_str)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Fallback line items parsing also failed: {e}")
-                        raise
-                else:
-                    raise
-
-        except (json.JSONDecodeError, Exception) as e:
-            logger.warning(f"Attempt {attempt + 1} failed in extract_line_items: {e}")
-            if attempt == 2:
-                logger.error(
-                    f"Error in extract_line_items_from_text after 3 attempts: {e}"
-                )
-                if "response" in locals():
-                    logger.error(f"Raw API response: {response.text}")
-                return []
-    return []
+    try:
+        return await call_with_retry("ai.extract_line_items", attempt)
+    except Exception as e:
+        logger.error(f"Error in extract_line_items_from_text: {e}")
+        return []
@@ -0,0 +1,182 @@
+# bot/ai_backend.py
+"""
+Backends that answer the bot's AI requests.
+
+- "gemini" calls the Gemini API (needs GEMINI_API_KEY).
+- "record" calls Gemini and appends every request and response to
+  AI_RECORDINGS_PATH.
+- "replay" answers from that file without any network access, so the whole
+  extraction-to-PDF flow can be load-tested and benchmarked offline.
+
+Requests are matched by a hash of the model name, generation config and
+contents (images by the hash of their encoded bytes). A request recorded
+several times is answered with its responses in recorded order, cycling.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# "gemini", "record" or "replay".
+AI_BACKEND = os.getenv("AI_BACKEND", "gemini").lower()
+AI_RECORDINGS_PATH = os.getenv("AI_RECORDINGS_PATH", "ai_recordings.jsonl")
+# Replayed responses are delayed by their recorded latency, or by this many
+# seconds if set to a number.
+AI_REPLAY_LATENCY = os.getenv("AI_REPLAY_LATENCY", "recorded")
+
+# Model and generation settings. Unset generation settings use the model's defaults.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_TEMPERATURE = os.getenv("GEMINI_TEMPERATURE")
+GEMINI_MAX_OUTPUT_TOKENS = os.getenv("GEMINI_MAX_OUTPUT_TOKENS")
+
+_configured = False
+# Shared GenerativeModel instances, keyed by model name and generation config.
+_models = {}
+
+
+def _default_generation_config() -> dict:
+    config = {}
+    if GEMINI_TEMPERATURE:
+        config["temperature"] = float(GEMINI_TEMPERATURE)
+    if GEMINI_MAX_OUTPUT_TOKENS:
+        config["max_output_tokens"] = int(GEMINI_MAX_OUTPUT_TOKENS)
+    return config
+
+
+def get_model(model_name: str = None, **generation_config) -> genai.GenerativeModel:
+    """
+    Returns the shared model for a model name and generation config, creating
+    it (and configuring the API key) on first use.
+    """
+    global _configured
+    model_name = model_name or GEMINI_MODEL
+    config = {**_default_generation_config(), **generation_config}
+    # Response schemas are dicts, so the config is keyed by its JSON form.
+    key = (model_name, json.dumps(config, sort_keys=True))
+
+    model = _models.get(key)
+    if model is None:
+        if not _configured:
+            api_key = os.environ.get("GEMINI_API_KEY")
+            if not api_key:
+                raise RuntimeError("GEMINI_API_KEY not set, cannot use AI features.")
+            genai.configure(api_key=api_key)
+            _configured = True
+        model = genai.GenerativeModel(model_name, generation_config=config or None)
+        _models[key] = model
+    return model
+
+
+def request_key(contents, model_name: str = None, **generation_config) -> str:
+    """Returns a stable hash identifying a request."""
+    if not isinstance(contents, list):
+        contents = [contents]
+    parts = []
+    for part in contents:
+        if isinstance(part, dict):
+            digest = hashlib.sha256(part["data"]).hexdigest()
+            parts.append({"mime_type": part["mime_type"], "sha256": digest})
+        else:
+            parts.append(str(part))
+    request = {
+        "model": model_name or GEMINI_MODEL,
+        "config": {**_default_generation_config(), **generation_config},
+        "contents": parts,
+    }
+    encoded = json.dumps(request, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class GeminiBackend:
+    """Sends requests to the Gemini API."""
+
+    def __init__(self):
+        if not os.environ.get("GEMINI_API_KEY"):
+            logger.error("GEMINI_API_KEY environment variable not set.")
+
+    async def generate(self, contents, model_name: str = None, **generation_config):
+        """Returns the response text for contents (a prompt or list of parts)."""
+        model = get_model(model_name, **generation_config)
+        response = await model.generate_content_async(contents)
+        return response.text
+
+
+class RecordingBackend:
+    """Passes requests to another backend and appends each exchange to a JSONL file."""
+
+    def __init__(self, inner, path: str = AI_RECORDINGS_PATH):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _append(self, record: dict) -> None:
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    async def generate(self, contents, model_name: str = None, **generation_config):
+        started = time.perf_counter()
+        text = await self.inner.generate(contents, model_name, **generation_config)
+        record = {
+            "key": request_key(contents, model_name, **generation_config),
+            "latency": round(time.perf_counter() - started, 3),
+            "text": text,
+        }
+        await asyncio.to_thread(self._append, record)
+        return text
+
+
+class ReplayBackend:
+    """Answers requests from a recordings file, without network access."""
+
+    def __init__(self, path: str = AI_RECORDINGS_PATH, latency=AI_REPLAY_LATENCY):
+        self.path = path
+        self.latency = None if latency == "recorded" else float(latency)
+        self._responses = defaultdict(list)
+        self._served = defaultdict(int)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._responses[record["key"]].append(record)
+        logger.info(
+            f"Replaying {sum(map(len, self._responses.values()))} recorded AI "
+            f"responses from {path}."
+        )
+
+    async def generate(self, contents, model_name: str = None, **generation_config):
+        key = request_key(contents, model_name, **generation_config)
+        records = self._responses.get(key)
+        if not records:
+            raise LookupError(f"No recorded AI response for request {key[:12]}.")
+        record = records[self._served[key] % len(records)]
+        self._served[key] += 1
+        await asyncio.sleep(record["latency"] if self.latency is None else self.latency)
+        return record["text"]
+
+
+_backend = None
+
+
+def get_backend():
+    """Returns the backend selected by AI_BACKEND, creating it on first use."""
+    global _backend
+    if _backend is None:
+        if AI_BACKEND == "replay":
+            _backend = ReplayBackend()
+        elif AI_BACKEND == "record":
+            _backend = RecordingBackend(GeminiBackend())
+        elif AI_BACKEND == "gemini":
+            _backend = GeminiBackend()
+        else:
+            raise ValueError(
+                f"Unknown AI_BACKEND '{AI_BACKEND}', expected gemini, record or replay."
+            )
+    return _backend
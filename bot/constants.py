@@ -1,6 +1,61 @@
 # bot/constants.py
+from enum import IntEnum
+
 
 # Conversation states
+class State(IntEnum):
+    START = 0
+    AWAITING_DOC_TYPE = 1
+    AWAITING_INFO = 2
+    REVIEWING_EXTRACTED_DATA = 3
+    CONFIRMING_DETAILS = 4
+    WAITING_FOR_COMPANY = 5
+    SELECTING_SERVICES = 6
+    WAITING_FOR_PRICE = 7
+    ASK_FOR_PAYMENT_PHASES = 8
+    COLLECTING_PHASE_AMOUNT = 9
+    AWAITING_PAYMENT_PHASE_REMARKS = 10
+    POST_GENERATION = 11
+    SELECTING_FIELD_TO_EDIT = 12
+    EDITING_FIELD = 13
+    AWAITING_ADD_NEW_DETAIL_TYPE = 14
+    WAITING_FOR_LORRY_PRICE = 15
+    SELECTING_LORRY_SALE_TYPE = 16
+    EDITING_LORRY_PRICE = 17
+    START_RENTAL_FLOW = 18
+    WAITING_FOR_RENTAL_PERIOD = 19
+    WAITING_FOR_RENTAL_START_DATE = 20
+    WAITING_FOR_RENTAL_END_DATE = 21
+    WAITING_FOR_CONTRACT_PERIOD = 22
+    WAITING_FOR_ROAD_TAX_PRICE = 23
+    WAITING_FOR_INSURANCE_PRICE = 24
+    WAITING_FOR_STICKER_PRICE = 25
+    SELECTING_EQUIPMENT = 26
+    WAITING_FOR_CUSTOM_SERVICE_NAME = 27
+    AWAITING_COMPANY_NAME_CONFIRMATION = 28
+    SELECTING_ITEM_TO_REMOVE = 29
+    WAITING_FOR_AGREEMENT_PRICE = 30  # New state for agreement fee
+    EDIT_MAIN_LINE_ITEMS = 31  # New state for editing main line items
+    EDIT_SERVICE_LINE_ITEMS = 32  # New state for editing service line items
+    EDITING_SERVICE_PRICE = 33
+    SELECTING_MAIN_SERVICE = 34
+    SELECTING_SUB_SERVICE = 35
+    AWAITING_SUB_SERVICE_PRICE = 36
+    SELECTING_BODY_WORK = 37
+    SELECTING_BODY_WORK_SUB = 38
+    SELECTING_ADDITIONAL_SERVICES = 39
+    AWAITING_CUSTOM_ADDITIONAL_SERVICE_NAME = 40
+    AWAITING_ADDITIONAL_SERVICE_PRICE = 41
+    SELECTING_PAYMENT_PHASE_TO_EDIT = 42
+    EDITING_PAYMENT_PHASE_AMOUNT = 43
+    EDITING_PAYMENT_PHASE_REMARKS = 44
+    REVIEWING_LINE_ITEMS = 45
+    WAITING_FOR_CUSTOM_EQUIPMENT = 46
+    SELECTING_ADDITIONAL_CATEGORY = 47
+    SELECTING_ADDITIONAL_SUB_SERVICE = 48
+
+
+# Module-level names for the states, as used throughout the bot.
 (
     START,
     AWAITING_DOC_TYPE,
@@ -32,9 +87,9 @@
     WAITING_FOR_CUSTOM_SERVICE_NAME,
     AWAITING_COMPANY_NAME_CONFIRMATION,
     SELECTING_ITEM_TO_REMOVE,
-    WAITING_FOR_AGREEMENT_PRICE,  # New state for agreement fee
-    EDIT_MAIN_LINE_ITEMS,  # New state for editing main line items
-    EDIT_SERVICE_LINE_ITEMS,  # New state for editing service line items
+    WAITING_FOR_AGREEMENT_PRICE,
+    EDIT_MAIN_LINE_ITEMS,
+    EDIT_SERVICE_LINE_ITEMS,
     EDITING_SERVICE_PRICE,
     SELECTING_MAIN_SERVICE,
     SELECTING_SUB_SERVICE,
@@ -51,7 +106,16 @@
     WAITING_FOR_CUSTOM_EQUIPMENT,
     SELECTING_ADDITIONAL_CATEGORY,
     SELECTING_ADDITIONAL_SUB_SERVICE,
-) = range(49)
+) = State
+
+
+def state_name(state) -> str:
+    """Returns the readable name of a state, or the raw value if it is not one."""
+    try:
+        return State(state).name
+    except ValueError:
+        return str(state)
+
 
 # Pre-defined lists
 EQUIPMENT_LIST = [
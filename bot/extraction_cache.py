@@ -0,0 +1,210 @@
+# bot/extraction_cache.py
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import PIL.Image
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Gemini extraction results are kept in this SQLite file; an empty path
+# disables the cache.
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "extraction_cache.sqlite3")
+# Entries older than this many seconds are not used (default one week).
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+# Beyond this many entries, the least recently used ones are evicted.
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "2000"))
+
+# Side of the difference hash grid; 16 gives a 256-bit hash, fine enough that
+# two different trucks photographed the same way do not collide.
+IMAGE_HASH_SIZE = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extraction_cache (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS extraction_cache_last_used
+    ON extraction_cache (last_used_at);
+"""
+
+
+def text_key(text: str) -> str:
+    """Hashes text after case-folding it and collapsing whitespace."""
+    normalized = " ".join(str(text).casefold().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def image_key(image: PIL.Image.Image, hash_size: int = IMAGE_HASH_SIZE) -> str:
+    """
+    Returns the difference hash (dHash) of an image as hex. Re-sent or
+    re-compressed copies of a photo hash the same, unlike their bytes.
+    """
+    small = image.convert("L").resize(
+        (hash_size + 1, hash_size), PIL.Image.Resampling.LANCZOS
+    )
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+class ExtractionCache:
+    """
+    Persistent LRU cache of extraction results (JSON) keyed by kind and a
+    content hash. Entries expire after `ttl` seconds; once there are more
+    than `max_entries`, the least recently used are evicted.
+    """
+
+    def __init__(
+        self,
+        db_path: str = EXTRACTION_CACHE_PATH,
+        ttl: float = EXTRACTION_CACHE_TTL,
+        max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def get(self, kind: str, key: str):
+        """Returns the cached result, or None if missing or expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result, created_at FROM extraction_cache "
+                "WHERE kind = ? AND key = ?",
+                (kind, key),
+            ).fetchone()
+            if row is not None and row[1] + self.ttl <= now:
+                self._conn.execute(
+                    "DELETE FROM extraction_cache WHERE kind = ? AND key = ?",
+                    (kind, key),
+                )
+                row = None
+            if row is None:
+                metrics.incr(f"extraction_cache.{kind}.misses")
+                return None
+            self._conn.execute(
+                "UPDATE extraction_cache SET last_used_at = ? "
+                "WHERE kind = ? AND key = ?",
+                (now, kind, key),
+            )
+        metrics.incr(f"extraction_cache.{kind}.hits")
+        return json.loads(row[0])
+
+    def set(self, kind: str, key: str, result) -> None:
+        """Stores a result and evicts expired and least recently used entries."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache "
+                "(kind, key, result, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(result), now, now),
+            )
+            evicted = self._conn.execute(
+                "DELETE FROM extraction_cache WHERE created_at <= ?",
+                (now - self.ttl,),
+            ).rowcount
+            evicted += self._conn.execute(
+                "DELETE FROM extraction_cache WHERE (kind, key) IN ("
+                "SELECT kind, key FROM extraction_cache ORDER BY last_used_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        if evicted:
+            metrics.incr("extraction_cache.evicted", evicted)
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM extraction_cache")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide extraction cache, or None if it is disabled."""
+    global _cache
+    if _cache is None and EXTRACTION_CACHE_PATH:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache()
+    return _cache
+
+
+def _code_constants(code) -> list:
+    """Returns the literals (e.g. prompt text) of code and of code nested in it."""
+    constants = []
+    for const in code.co_consts:
+        if isinstance(const, (str, bytes, int, float)):
+            constants.append(const)
+        elif hasattr(const, "co_consts"):
+            constants.append(_code_constants(const))
+    return constants
+
+
+def extractor_version(func, *inputs) -> str:
+    """
+    Returns a short hash of an extractor's literals (its prompt) and of
+    inputs such as its response schema and model, so results produced
+    under another prompt or schema are not served.
+    """
+    fingerprint = json.dumps(
+        [_code_constants(func.__code__), inputs], sort_keys=True, default=repr
+    )
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+def cached_extraction(kind: str, key_func, *inputs):
+    """
+    Decorator caching an async extractor that takes one argument. key_func
+    turns the argument into the cache key, which is prefixed with the
+    extractor's version (see extractor_version; inputs are passed on to
+    it). Empty results are not cached, so failed extractions are retried
+    next time.
+    """
+
+    def decorator(func):
+        version = extractor_version(func, *inputs)
+
+        @functools.wraps(func)
+        async def wrapper(arg):
+            cache = get_cache()
+            if cache is None:
+                return await func(arg)
+
+            key = f"{version}:{await asyncio.to_thread(key_func, arg)}"
+            cached = await asyncio.to_thread(cache.get, kind, key)
+            if cached is not None:
+                logger.info(f"Using cached {kind} extraction {key[:25]}.")
+                return cached
+
+            result = await func(arg)
+            if result:
+                await asyncio.to_thread(cache.set, kind, key, result)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,200 @@
+# bot/fast_extract.py
+"""
+Rule-based extraction of quote details from short, regular messages such as
+"sales VAN 5222 ABC Sdn Bhd 012-3456789 RM85000".
+
+The extractor finds plates, phone numbers, prices, contract periods, company
+names and doc-type keywords with precompiled patterns and reports how much of
+the message it understood. Words it cannot place (e.g. "please", "to") count
+against it. The caller only falls back to Gemini when that confidence is
+below FAST_EXTRACT_MIN_CONFIDENCE.
+"""
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+
+from .helpers import (
+    parse_line_items_from_text,
+    validate_phone_number,
+    validate_truck_number,
+)
+
+logger = logging.getLogger(__name__)
+
+# Share of the message (in non-space characters) the rules must account for
+# before their result is used instead of asking Gemini.
+FAST_EXTRACT_MIN_CONFIDENCE = float(os.getenv("FAST_EXTRACT_MIN_CONFIDENCE", "0.9"))
+
+_DOC_TYPE_KEYWORDS = {
+    "sales": ("sales", "sale", "sell", "jual"),
+    "rental": ("rental", "rent", "hire", "sewa"),
+    "refurbish": ("refurbish", "refurb", "repair", "baiki"),
+}
+_DOC_TYPE_REGEX = re.compile(
+    "|".join(
+        rf"\b(?P<{doc_type}>{'|'.join(keywords)})\b"
+        for doc_type, keywords in _DOC_TYPE_KEYWORDS.items()
+    ),
+    re.IGNORECASE,
+)
+# Prices need the RM prefix; bare numbers are too ambiguous.
+_PRICE_REGEX = re.compile(r"\bRM\s?(\d[\d,]*(?:\.\d{1,2})?)\b", re.IGNORECASE)
+_PHONE_REGEX = re.compile(r"(?<![\d+])(?:\+?6)?01\d[\s-]?\d{3,4}[\s-]?\d{4}(?!\d)")
+# Peninsular, Sabah/Sarawak and most special series: prefix letters, up to
+# four digits and an optional suffix letter, e.g. VAN 5222, WXY1234A, QAA 88 B.
+_PLATE_REGEX = re.compile(r"\b([A-Z]{1,3})\s?([1-9]\d{0,3})(?:\s?([A-Z]))?\b")
+_PERIOD_REGEX = re.compile(r"\b(\d{1,2})\s?(month|year)s?\b", re.IGNORECASE)
+# A company name is the run of up to five words before its legal or trade
+# suffixes, e.g. "ABC Trading Sdn Bhd".
+_COMPANY_SUFFIX = (
+    r"(?:SDN\.?\s*BHD\.?|BHD\.?|PLT|ENTERPRISE|TRADING|RESOURCES|LOGISTICS)(?!\w)"
+)
+_COMPANY_SUFFIX_REGEX = re.compile(
+    rf"(?<![\w&.'-]){_COMPANY_SUFFIX}(?:[ \t]+{_COMPANY_SUFFIX})*", re.IGNORECASE
+)
+# The last word of the text before a position.
+_LAST_WORD_REGEX = re.compile(r"[\w&][\w&.'-]*$")
+# Words that end a name when walking back from its suffix, so "sell VAN 5222
+# to ABC Sdn Bhd" yields "ABC Sdn Bhd" rather than the whole sentence.
+_NAME_STOP_WORDS = frozenset(
+    "a an at buy by for from i in is me of on our please quote quotation send "
+    "the to we with".split()
+).union(*_DOC_TYPE_KEYWORDS.values())
+_NAME_MAX_WORDS = 5
+
+# Stands in for text a pattern has already matched.
+_BLANK = "\0"
+
+
+@dataclass(slots=True)
+class FastExtraction:
+    details: dict = field(default_factory=dict)
+    # Fraction of the message's non-space characters explained by the rules.
+    confidence: float = 0.0
+
+
+def _count_chars(text: str) -> int:
+    return sum(not char.isspace() and char != _BLANK for char in text)
+
+
+class _Scanner:
+    """Blanks out matched spans so later patterns only see unexplained text."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.total = _count_chars(text)
+
+    def blank(self, start: int, end: int) -> None:
+        self.text = self.text[:start] + _BLANK * (end - start) + self.text[end:]
+
+    def take(self, regex: re.Pattern, accept=lambda match: True):
+        """Yields accepted matches of regex and removes them from the text."""
+        for match in list(regex.finditer(self.text)):
+            if accept(match):
+                self.blank(*match.span())
+                yield match
+
+    def take_companies(self):
+        """
+        Yields company names: the words directly before each suffix, up to
+        a stop word, a line break or text that was already matched.
+        """
+        for suffix in list(_COMPANY_SUFFIX_REGEX.finditer(self.text)):
+            start = suffix.start()
+            words = 0
+            while words < _NAME_MAX_WORDS:
+                head = self.text[:start].rstrip(" \t")
+                if len(head) == start:  # not separated by a space
+                    break
+                word = _LAST_WORD_REGEX.search(head)
+                if word is None or word.group(0).lower() in _NAME_STOP_WORDS:
+                    break
+                start = word.start()
+                words += 1
+            if words:
+                name = self.text[start : suffix.end()]
+                self.blank(start, suffix.end())
+                yield " ".join(name.split())
+
+    @property
+    def explained(self) -> float:
+        if not self.total:
+            return 0.0
+        return 1 - _count_chars(self.text) / self.total
+
+
+def _normalize_plate(match: re.Match) -> str:
+    return " ".join(part.upper() for part in match.groups() if part)
+
+
+def _is_plate(match: re.Match) -> bool:
+    # Plates are written in capitals; this keeps words like "for 2" out.
+    return match.group(1).isupper() and validate_truck_number(match.group(0))[0]
+
+
+def _is_phone(match: re.Match) -> bool:
+    return validate_phone_number(match.group(0))[0]
+
+
+def fast_extract(text: str, doc_type: str = None) -> FastExtraction:
+    """
+    Extracts what the rules can from text. doc_type is the type already
+    chosen by the user, if any; a lone price is taken as the rental amount
+    of a rental request or the lorry price of a sales request.
+    """
+    scanner = _Scanner(text)
+    details = {}
+
+    # Lines that read as "description ... RM price" are line items.
+    line_items = []
+    for line in text.splitlines():
+        without_prices = _PRICE_REGEX.sub(" ", line)
+        if without_prices != line and not (
+            _PHONE_REGEX.search(without_prices) or _PLATE_REGEX.search(without_prices)
+        ):
+            items = parse_line_items_from_text(line)
+            if items and items[0]["line_description"] != "Item":
+                line_items.extend(items)
+                start = scanner.text.find(line)
+                scanner.blank(start, start + len(line))
+
+    prices = [
+        float(match.group(1).replace(",", ""))
+        for match in scanner.take(_PRICE_REGEX)
+    ]
+
+    for match in scanner.take(_PHONE_REGEX, _is_phone):
+        details.setdefault("cust_contact", match.group(0).strip())
+
+    for match in scanner.take(_PLATE_REGEX, _is_plate):
+        details.setdefault("truck_number", _normalize_plate(match))
+
+    for match in scanner.take(_DOC_TYPE_REGEX):
+        details.setdefault("doc_type", match.lastgroup)
+    doc_type = doc_type or details.get("doc_type")
+
+    if doc_type == "rental":
+        for match in scanner.take(_PERIOD_REGEX):
+            number, unit = match.groups()
+            unit = unit.title() + ("s" if number != "1" else "")
+            details.setdefault("contract_period", f"{number} {unit}")
+
+    # Last, so the words taken above do not end up in the name.
+    for name in scanner.take_companies():
+        details.setdefault("company_name", name)
+
+    if len(prices) == 1 and doc_type == "rental":
+        details["rental_amount"] = prices[0]
+    elif len(prices) == 1 and doc_type == "sales" and not line_items:
+        # Used once the user has picked the lorry sale type.
+        details["lorry_price"] = prices[0]
+    elif prices:
+        # Not clear what the prices are for; leave the message to Gemini.
+        return FastExtraction(details, 0.0)
+    if line_items:
+        details["line_items"] = line_items
+
+    if "truck_number" not in details and "company_name" not in details:
+        return FastExtraction(details, 0.0)
+    return FastExtraction(details, round(scanner.explained, 3))
@@ -0,0 +1,261 @@
+# bot/flow.py
+"""
+Declarative description of the quote flow.
+
+Each doc type has an ordered table of steps. A step is satisfied when its
+`done` predicate holds for the chat's user_data; the first unsatisfied step
+is the one the bot acts on next. Steps with a `resolve` function fill in
+their data themselves instead of asking the user.
+
+This module only looks at plain dicts, so the flow can be tested without
+Telegram. bot/logic.py maps each step's `action` to the message it sends.
+"""
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Optional
+
+from .constants import (
+    ASK_FOR_PAYMENT_PHASES,
+    AWAITING_COMPANY_NAME_CONFIRMATION,
+    AWAITING_DOC_TYPE,
+    AWAITING_INFO,
+    SELECTING_ADDITIONAL_SERVICES,
+    SELECTING_LORRY_SALE_TYPE,
+    SELECTING_MAIN_SERVICE,
+    WAITING_FOR_COMPANY,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class Step:
+    name: str
+    done: Callable[[dict], bool]
+    # Name of the logic.py action that asks the user for this step.
+    action: Optional[str] = None
+    # Conversation state to enter before running the action.
+    state: Optional[int] = None
+    # Fills in the step's data without asking the user.
+    resolve: Optional[Callable[[dict], None]] = None
+    # For "missing_field" steps: the user_data key and how to ask for it.
+    field: Optional[str] = None
+    prompt: Optional[str] = None
+
+
+# --- Predicates and resolvers ---
+
+
+def _has_image_company_name(data: dict) -> bool:
+    return bool(
+        data.get("is_company_name_from_image_extracted")
+        and data.get("extracted_image_company_name")
+    )
+
+
+def _use_image_company_name(data: dict) -> None:
+    """Refurbish quotes take the company name read from the image as-is."""
+    data["company_name"] = data["extracted_image_company_name"]
+    if "extracted_image_company_address" in data:
+        data["company_address"] = data["extracted_image_company_address"]
+    data.pop("is_company_name_from_image_extracted", None)
+    data.pop("extracted_image_company_name", None)
+    data.pop("extracted_image_company_address", None)
+    logger.info(f"Refurbish quote: Auto-using company name from image: {data['company_name']}")
+
+
+def _field_provided(field: str) -> Callable[[dict], bool]:
+    def done(data: dict) -> bool:
+        # "0" or "N/A" count as provided (they are hidden on the PDF).
+        value = data.get(field)
+        return bool(value) or str(value).strip().upper() in ("0", "N/A")
+
+    return done
+
+
+def _issuing_company_set(data: dict) -> bool:
+    issuing_company = str(data.get("issuing_company", "")).strip()
+    return bool(issuing_company) and issuing_company.upper() != "N/A"
+
+
+_RENTAL_DETAIL_KEYS = {
+    "daily": (
+        "rental_start_date",
+        "rental_end_date",
+        "rental_amount",
+        "security_deposit",
+    ),
+    "monthly": ("contract_period", "rental_amount", "security_deposit"),
+}
+
+
+def _rental_details_complete(data: dict) -> bool:
+    keys = _RENTAL_DETAIL_KEYS.get(data.get("rental_period_type"))
+    return keys is not None and all(key in data for key in keys)
+
+
+def _flag(key: str) -> Callable[[dict], bool]:
+    return lambda data: bool(data.get(key))
+
+
+def _set_flag(key: str) -> Callable[[dict], None]:
+    def resolve(data: dict) -> None:
+        data[key] = True
+
+    return resolve
+
+
+# --- Steps ---
+
+DOC_TYPE = Step(
+    "doc_type", _flag("doc_type"), action="doc_type", state=AWAITING_DOC_TYPE
+)
+CUSTOMER_LOOKUP = Step(
+    "customer_lookup",
+    lambda data: not data.get("company_name") or data.get("customer_checked"),
+    action="customer_lookup",
+)
+ISSUING_COMPANY = Step(
+    "issuing_company",
+    _issuing_company_set,
+    action="issuing_company",
+    state=WAITING_FOR_COMPANY,
+)
+
+_REQUIRED_FIELDS = (
+    ("company_name", "customer company name"),
+    ("company_address", "customer company address"),
+    ("cust_contact", "customer's phone number"),
+    ("salesperson", "salesperson's name"),
+    ("truck_number", "truck number (e.g., 'VAN 5222')"),
+)
+
+
+def _required_field_steps(*extra_fields) -> tuple:
+    return tuple(
+        Step(
+            f"field:{field}",
+            _field_provided(field),
+            action="missing_field",
+            state=AWAITING_INFO,
+            field=field,
+            prompt=prompt,
+        )
+        for field, prompt in _REQUIRED_FIELDS + extra_fields
+    )
+
+
+def _customer_steps(image_name_step: Step, *extra_fields) -> tuple:
+    """Steps shared by every doc type: customer, required fields, issuing company."""
+    return (
+        image_name_step,
+        CUSTOMER_LOOKUP,
+        *_required_field_steps(*extra_fields),
+        ISSUING_COMPANY,
+    )
+
+
+CONFIRM_IMAGE_COMPANY_NAME = Step(
+    "image_company_name",
+    lambda data: not _has_image_company_name(data),
+    action="confirm_company_name",
+    state=AWAITING_COMPANY_NAME_CONFIRMATION,
+)
+USE_IMAGE_COMPANY_NAME = Step(
+    "image_company_name",
+    lambda data: not _has_image_company_name(data),
+    resolve=_use_image_company_name,
+)
+
+FLOWS = {
+    "sales": (
+        DOC_TYPE,
+        *_customer_steps(CONFIRM_IMAGE_COMPANY_NAME, ("body", "body type")),
+        Step(
+            "lorry_sale_type",
+            _flag("lorry_sale_item_created"),
+            action="lorry_sale_type",
+            state=SELECTING_LORRY_SALE_TYPE,
+        ),
+        Step(
+            "main_services",
+            _flag("main_services_done"),
+            action="main_services",
+            state=SELECTING_MAIN_SERVICE,
+        ),
+        Step(
+            "additional_services",
+            _flag("additional_services_done"),
+            action="additional_services",
+            state=SELECTING_ADDITIONAL_SERVICES,
+        ),
+        Step(
+            "payment_phases",
+            _flag("payment_phases_complete"),
+            action="payment_phases",
+            state=ASK_FOR_PAYMENT_PHASES,
+        ),
+    ),
+    "rental": (
+        DOC_TYPE,
+        *_customer_steps(CONFIRM_IMAGE_COMPANY_NAME),
+        Step("rental_details", _rental_details_complete, action="rental_details"),
+        Step(
+            "rental_details_collected",
+            _flag("rental_details_collected"),
+            resolve=_set_flag("rental_details_collected"),
+        ),
+        Step(
+            "rental_fees",
+            lambda data: bool(
+                data.get("rental_fees_collected")
+                and data.get("rental_equipment_collected")
+            ),
+            action="rental_fees",
+        ),
+    ),
+    "refurbish": (
+        DOC_TYPE,
+        *_customer_steps(USE_IMAGE_COMPANY_NAME, ("body", "body type")),
+        Step(
+            "refurbish_line_items",
+            _flag("line_items"),
+            action="refurbish_line_items",
+            state=AWAITING_INFO,
+            field="line_items",
+        ),
+    ),
+}
+
+# Doc types without a flow of their own (or not chosen yet).
+_DEFAULT_FLOW = (
+    DOC_TYPE,
+    CUSTOMER_LOOKUP,
+    *_required_field_steps(),
+    ISSUING_COMPANY,
+)
+
+
+@lru_cache(maxsize=None)
+def steps_for(doc_type: Optional[str]) -> tuple:
+    """Returns the step table for a doc type; proforma variants share their base flow."""
+    for prefix, steps in FLOWS.items():
+        if doc_type and doc_type.startswith(prefix):
+            return steps
+    return _DEFAULT_FLOW
+
+
+def next_step(data: dict) -> Optional[Step]:
+    """
+    Returns the first step that still needs the user, applying auto-resolving
+    steps on the way, or None once everything is collected.
+    """
+    for step in steps_for(data.get("doc_type")):
+        if step.done(data):
+            continue
+        if step.resolve is not None:
+            step.resolve(data)
+            continue
+        return step
+    return None
@@ -1,9 +1,11 @@
+import asyncio
+import gzip
+import io
 import logging
 import os
 import PIL.Image
 from datetime import datetime
 import telegram
-import json
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, InputFile
 from telegram.ext import ContextTypes
 import copy
@@ -17,6 +19,7 @@ from .helpers import (
     validate_date,
     get_gl_code_for_service,
     to_ordinal,
+    prefetch_customer,
     search_customer_by_name,
     parse_line_items_from_text,
 )
@@ -65,15 +68,50 @@ from .keyboards import (
     build_additional_services_subcategory_keyboard,
     build_additional_services_items_keyboard,
 )
+from log_utils import BOT_LOG_FILE, dump_debug, parse_duration, tail_log_records
 from .templates import edit_field_prompt
+from . import metrics, prefetch
+from .fast_extract import FAST_EXTRACT_MIN_CONFIDENCE, fast_extract
+from .router import CallbackRouter
+from .state_history import get_state_history
 
 
 logger = logging.getLogger(__name__)
 
+# Button callbacks are routed here by the @callback_router.route decorators below.
+callback_router = CallbackRouter()
+
+# Records sent by /reprintlog when neither N nor a time window is given.
+REPRINTLOG_DEFAULT_RECORDS = int(os.getenv("REPRINTLOG_DEFAULT_RECORDS", "200"))
+
+# Photos larger than this are not downloaded; a smaller size Telegram offers
+# for the same photo is used instead, if there is one.
+MAX_PHOTO_BYTES = int(os.getenv("MAX_PHOTO_BYTES", str(10 * 1024 * 1024)))
+
+# Text message handlers per conversation state, registered with @text_handler.
+_TEXT_HANDLERS = {}
+
+
+def text_handler(*states: State):
+    """Decorator registering a handle_text handler for one or more states."""
+
+    def decorator(handler):
+        for state in states:
+            if state in _TEXT_HANDLERS:
+                raise ValueError(
+                    f"State {state.name} already handled by "
+                    f"{_TEXT_HANDLERS[state].__name__}, cannot add {handler.__name__}."
+                )
+            _TEXT_HANDLERS[state] = handler
+        return handler
+
+    return decorator
+
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /start command by clearing data and showing the main menu."""
     context.user_data.clear()
+    prefetch.discard(update.effective_chat.id)
 
     message = update.message or (
         update.callback_query.message if update.callback_query else None
@@ -86,17 +124,67 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error("Could not find a message to reply to in start_command.")
 
 
+REPRINTLOG_USAGE = (
+    "Usage: /reprintlog [N] [since 30m|2h|1d] [chat [CHAT_ID]] [doc DOC_NO]\n"
+    "e.g. /reprintlog 500, /reprintlog since 2h chat, /reprintlog doc UESQ-VAN5222"
+)
+
+
+def _parse_reprintlog_args(args: list, own_chat_id: int) -> dict:
+    """Turns /reprintlog arguments into tail_log_records() filters."""
+    filters = {"limit": None, "since": None, "contains": []}
+    tokens = list(args)
+    while tokens:
+        token = tokens.pop(0).lower()
+        if token.isdigit():
+            filters["limit"] = int(token)
+        elif token == "since" and tokens:
+            filters["since"] = datetime.now() - parse_duration(tokens.pop(0))
+        elif token == "chat":
+            chat_id = own_chat_id
+            if tokens and tokens[0].lstrip("-").isdigit():
+                chat_id = tokens.pop(0)
+            filters["contains"].append(f" - chat {chat_id} - ")
+        elif token == "doc" and tokens:
+            filters["contains"].append(tokens.pop(0))
+        else:
+            raise ValueError(f"Unknown argument '{token}'.")
+
+    if filters["limit"] is None and filters["since"] is None:
+        filters["limit"] = REPRINTLOG_DEFAULT_RECORDS
+    return filters
+
+
+def _build_log_excerpt(filters: dict) -> tuple[int, bytes]:
+    """Collects the matching log records and gzips them."""
+    records = tail_log_records(BOT_LOG_FILE, **filters)
+    text = "\n".join(records) + "\n" if records else ""
+    return len(records), gzip.compress(text.encode("utf-8"))
+
+
 async def reprint_log_command(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
-    """Sends the bot output log file to the user."""
-    log_file = "bot output.txt"
+    """Sends the matching part of the bot log file to the user, gzip-compressed."""
     try:
-        with open(log_file, "rb") as f:
-            await context.bot.send_document(
-                chat_id=update.effective_chat.id,
-                document=InputFile(f, filename=log_file),
-            )
+        filters = _parse_reprintlog_args(context.args or [], update.effective_chat.id)
+    except ValueError as e:
+        await update.message.reply_text(f"{e}\n\n{REPRINTLOG_USAGE}")
+        return
+
+    try:
+        # Reading and compressing run in a worker thread to keep the loop free.
+        count, excerpt = await asyncio.to_thread(_build_log_excerpt, filters)
+        if not count:
+            await update.message.reply_text("No matching log lines found.")
+            return
+        log_name = os.path.basename(BOT_LOG_FILE)
+        filename = f"{log_name}-{datetime.now():%Y%m%d-%H%M%S}.gz"
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=InputFile(io.BytesIO(excerpt), filename=filename),
+            caption=f"{count} log record(s).",
+        )
     except FileNotFoundError:
         await update.message.reply_text("Log file not found.")
     except Exception as e:
@@ -105,675 +193,771 @@ async def reprint_log_command(
         )
 
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends the in-process metrics (connection reuse, timings, ...) to the user."""
+    await update.message.reply_text(metrics.format_snapshot())
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles all incoming text messages, orchestrating the conversation flow."""
     user_text = update.message.text
     current_state = context.user_data.get("state", START)
 
-    # Readable state mapping for logs
-    state_names = {
-        v: k for k, v in globals().items() if isinstance(v, int) and k.isupper()
-    }
-    readable_state = state_names.get(current_state, str(current_state))
-
-    logger.info(f"handle_text: Current state: {readable_state}, User text: {user_text}")
+    logger.info(
+        f"handle_text: Current state: {state_name(current_state)}, User text: {user_text}"
+    )
 
     # Push current state to history if different from last
-    state_history = context.user_data.get("state_history", [])
-    if not state_history or state_history[-1] != current_state:
-        state_history.append(current_state)
-    context.user_data["state_history"] = state_history
-
-    if current_state == START:
-        context.user_data.clear()
-        initial_text = user_text.lower()
-        explicit_doc_type = None
-        if "sales" in initial_text:
-            explicit_doc_type = "sales"
-            user_text = user_text.replace("sales", "", 1)
-        elif "rental" in initial_text:
-            explicit_doc_type = "rental"
-            user_text = user_text.replace("rental", "", 1)
-        elif "refurbish" in initial_text:
-            explicit_doc_type = "refurbish"
-            user_text = user_text.replace("refurbish", "", 1)
+    get_state_history(context.user_data).push(current_state)
+
+    handler = _TEXT_HANDLERS.get(current_state, _text_fallback)
+    await handler(update, context, user_text)
+
+
+async def _text_fallback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    # Fallback for unhandled text, transition to check_and_transition
+    await check_and_transition(update, context)
+
 
+@text_handler(START)
+async def _text_start(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    context.user_data.clear()
+    prefetch.discard(update.effective_chat.id)
+    initial_text = user_text.lower()
+    explicit_doc_type = None
+    if "sales" in initial_text:
+        explicit_doc_type = "sales"
+        user_text = user_text.replace("sales", "", 1)
+    elif "rental" in initial_text:
+        explicit_doc_type = "rental"
+        user_text = user_text.replace("rental", "", 1)
+    elif "refurbish" in initial_text:
+        explicit_doc_type = "refurbish"
+        user_text = user_text.replace("refurbish", "", 1)
+
+    fast = fast_extract(user_text, explicit_doc_type)
+    if fast.confidence >= FAST_EXTRACT_MIN_CONFIDENCE:
+        metrics.incr("fast_extract.used")
+        logger.info(f"Extracted details locally (confidence {fast.confidence}).")
+        details = fast.details
+    else:
+        metrics.incr("fast_extract.fallback")
+        # Look up the name the rules found while Gemini reads the message;
+        # it is used if Gemini agrees on the name.
+        prefetch_customer(update.effective_chat.id, fast.details.get("company_name"))
         await update.message.reply_text("Analyzing your request...")
         details = await extract_details_from_text(user_text)
 
-        # Always go to a review step to let the user see what the AI extracted
-        # and correct any "hallucinated" fields.
-        logger.info(
-            f"DEBUG: Details from AI to be reviewed by user: {json.dumps(details, indent=2, default=str)}"
-        )
+    # Always go to a review step to let the user see what the AI extracted
+    # and correct any "hallucinated" fields.
+    dump_debug(logger, "Details from AI to be reviewed by user:", details)
+    prefetch_customer(update.effective_chat.id, details.get("company_name"))
 
-        if explicit_doc_type:
-            context.user_data["doc_type"] = explicit_doc_type
+    if explicit_doc_type:
+        context.user_data["doc_type"] = explicit_doc_type
 
-        for key, value in details.items():
-            if value:
-                context.user_data[key] = value
+    for key, value in details.items():
+        if value:
+            context.user_data[key] = value
 
-        await send_confirmation_message(update, context, is_review=True)
+    await send_confirmation_message(update, context, is_review=True)
+
+
+@text_handler(WAITING_FOR_CUSTOM_EQUIPMENT)
+async def _text_waiting_for_custom_equipment(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    equipment_name = user_text.strip()
+    if equipment_name:
+        selected_equipment = context.user_data.get("selected_equipment", [])
+        if equipment_name not in selected_equipment:
+            selected_equipment.append(equipment_name)
+        context.user_data["selected_equipment"] = selected_equipment
+        await update.message.reply_text(f"'{equipment_name}' added to equipment.")
+        # Re-show the equipment list with the new item selected
+        await show_equipment_checklist(update, context)
+    else:
+        await update.message.reply_text(
+            "Equipment name cannot be empty. Please try again."
+        )
+
+
+@text_handler(AWAITING_INFO)
+async def _text_awaiting_info(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    field_to_fill = context.user_data.get("waiting_for_field")
+    if not field_to_fill:
+        await check_and_transition(update, context)
         return
 
-    if current_state == WAITING_FOR_CUSTOM_EQUIPMENT:
-        equipment_name = user_text.strip()
-        if equipment_name:
-            selected_equipment = context.user_data.get("selected_equipment", [])
-            if equipment_name not in selected_equipment:
-                selected_equipment.append(equipment_name)
-            context.user_data["selected_equipment"] = selected_equipment
-            await update.message.reply_text(f"'{equipment_name}' added to equipment.")
-            # Re-show the equipment list with the new item selected
-            await show_equipment_checklist(update, context)
-        else:
+    is_valid, processed_value, error_message = True, user_text, ""
+
+    if field_to_fill == "truck_number":
+        is_valid, error_message = validate_truck_number(user_text)
+        if is_valid:
+            processed_value = user_text.strip().upper()
+    elif field_to_fill == "cust_contact":
+        is_valid, error_message = validate_phone_number(user_text)
+        if is_valid:
+            processed_value = user_text.strip()
+    elif field_to_fill == "company_address":
+        processed_value = "\n".join(
+            [line.strip() for line in user_text.split("\n") if line.strip()]
+        )
+    elif field_to_fill in [
+        "rental_amount",
+        "security_deposit",
+        "road_tax_amount",
+        "insurance_amount",
+        "sticker_amount",
+        "agreement_amount",
+        "puspakom_amount",
+    ]:
+        is_valid, price, error_message = validate_price(user_text)
+        if not is_valid:
             await update.message.reply_text(
-                "Equipment name cannot be empty. Please try again."
+                f"❌ {error_message}\n\nPlease try again:"
             )
-        return
+            return
+        context.user_data[field_to_fill] = price
+
+        # Check if we are just editing a single value (not in the initial collection flow)
+        # If fees_to_ask is empty, we are likely editing.
+        if context.user_data.get(
+            "rental_fees_collected"
+        ) and not context.user_data.get("fees_to_ask"):
+            # Manually trigger a silent rebuild of the fee items
+            rebuild_rental_fee_items(context)
 
-    field_to_fill = context.user_data.get("waiting_for_field")
+            # Now force state back to edit menu
+            context.user_data["state"] = SELECTING_FIELD_TO_EDIT
+            context.user_data.pop("waiting_for_field", None)
+            reply_markup = build_edit_fields_keyboard(context.user_data)
+            await update.message.reply_text(
+                f"✅ {field_to_fill.replace('_', ' ').title()} updated to RM {price:,.2f}. Returning to menu.",
+                reply_markup=reply_markup,
+            )
+            return
 
-    if current_state == AWAITING_INFO and field_to_fill:
-        is_valid, processed_value, error_message = True, user_text, ""
-
-        if field_to_fill == "truck_number":
-            is_valid, error_message = validate_truck_number(user_text)
-            if is_valid:
-                processed_value = user_text.strip().upper()
-        elif field_to_fill == "cust_contact":
-            is_valid, error_message = validate_phone_number(user_text)
-            if is_valid:
-                processed_value = user_text.strip()
-        elif field_to_fill == "company_address":
-            processed_value = "\n".join(
-                [line.strip() for line in user_text.split("\n") if line.strip()]
+        if field_to_fill == "rental_amount":
+            context.user_data["waiting_for_field"] = "security_deposit"
+            await update.message.reply_text(
+                f"✅ Rental amount set to RM {price:,.2f}. Now, please provide the security deposit amount:"
             )
-        elif field_to_fill in [
-            "rental_amount",
-            "security_deposit",
-            "road_tax_amount",
-            "insurance_amount",
-            "sticker_amount",
-            "agreement_amount",
-            "puspakom_amount",
-        ]:
-            is_valid, price, error_message = validate_price(user_text)
-            if not is_valid:
-                await update.message.reply_text(
-                    f"❌ {error_message}\n\nPlease try again:"
-                )
-                return
-            context.user_data[field_to_fill] = price
-
-            # Check if we are just editing a single value (not in the initial collection flow)
-            # If fees_to_ask is empty, we are likely editing.
-            if context.user_data.get(
-                "rental_fees_collected"
-            ) and not context.user_data.get("fees_to_ask"):
-                # Manually trigger a silent rebuild of the fee items
-                rebuild_rental_fee_items(context)
-
-                # Now force state back to edit menu
-                context.user_data["state"] = SELECTING_FIELD_TO_EDIT
-                context.user_data.pop("waiting_for_field", None)
-                reply_markup = build_edit_fields_keyboard(context.user_data)
-                await update.message.reply_text(
-                    f"✅ {field_to_fill.replace('_', ' ').title()} updated to RM {price:,.2f}. Returning to menu.",
-                    reply_markup=reply_markup,
-                )
-                return
+            return
+        elif field_to_fill == "security_deposit":
+            # Normal flow falls through to check_and_transition
+            processed_value = price
+        else:
+            # Should not happen in normal flow if fees_to_ask is working,
+            # but if it does, just fall through.
+            processed_value = price
+    elif field_to_fill == "line_items":
+        parsed_items = await extract_line_items_from_text(
+            user_text
+        )  # Use the new AI function
+        if not parsed_items:
+            is_valid = False
+            error_message = "I couldn't understand the line items. Please provide them again, for example: '1 unit New Lorry - RM 150000'."
+        else:
+            for item in parsed_items:
+                if isinstance(item, dict) and "line_description" in item:
+                    item["gl_code"] = get_gl_code_for_service(
+                        item["line_description"]
+                    )
+                else:
+                    logger.warning(f"AI returned a malformed line item: {item}")
+                    continue  # Skip this malformed item
 
-            if field_to_fill == "rental_amount":
-                context.user_data["waiting_for_field"] = "security_deposit"
-                await update.message.reply_text(
-                    f"✅ Rental amount set to RM {price:,.2f}. Now, please provide the security deposit amount:"
-                )
-                return
-            elif field_to_fill == "security_deposit":
-                # Normal flow falls through to check_and_transition
-                processed_value = price
-            else:
-                # Should not happen in normal flow if fees_to_ask is working,
-                # but if it does, just fall through.
-                processed_value = price
-        elif field_to_fill == "line_items":
-            parsed_items = await extract_line_items_from_text(
-                user_text
-            )  # Use the new AI function
-            if not parsed_items:
-                is_valid = False
-                error_message = "I couldn't understand the line items. Please provide them again, for example: '1 unit New Lorry - RM 150000'."
-            else:
-                for item in parsed_items:
-                    if isinstance(item, dict) and "line_description" in item:
-                        item["gl_code"] = get_gl_code_for_service(
-                            item["line_description"]
-                        )
-                    else:
-                        logger.warning(f"AI returned a malformed line item: {item}")
-                        continue  # Skip this malformed item
-
-                # Append to existing items instead of replacing
-                existing_items = context.user_data.get("line_items", [])
-
-                # Filter out valid new items
-                new_valid_items = [
-                    item for item in parsed_items if isinstance(item, dict)
-                ]
+            # Append to existing items instead of replacing
+            existing_items = context.user_data.get("line_items", [])
 
-                # Combine lists
-                context.user_data["line_items"] = existing_items + new_valid_items
+            # Filter out valid new items
+            new_valid_items = [
+                item for item in parsed_items if isinstance(item, dict)
+            ]
 
-                context.user_data.pop("waiting_for_field", None)
+            # Combine lists
+            context.user_data["line_items"] = existing_items + new_valid_items
 
-                # Instead of going to the edit menu, go to the line item review
-                await ask_for_line_item_review(update, context)
-                return
+            context.user_data.pop("waiting_for_field", None)
 
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
+            # Instead of going to the edit menu, go to the line item review
+            await ask_for_line_item_review(update, context)
             return
 
-        context.user_data[field_to_fill] = processed_value
-        context.user_data.pop("waiting_for_field", None)
-        await check_and_transition(update, context)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
         return
 
-    if current_state == EDITING_FIELD:
-        field_to_edit = context.user_data.pop("editing_field", None)
-        if not field_to_edit:
-            await update.message.reply_text("An error occurred. Please start over.")
-            return await start_command(update, context)
-
-        is_valid, processed_value, error_message = True, user_text, ""
-
-        if field_to_edit == "truck_number":
-            is_valid, error_message = validate_truck_number(user_text)
-            if is_valid:
-                processed_value = user_text.strip().upper()
-        elif field_to_edit == "cust_contact":
-            is_valid, error_message = validate_phone_number(user_text)
-            if is_valid:
-                processed_value = user_text.strip()
-        elif field_to_edit == "rental_start_date":
-            is_valid, date_obj, error_message = validate_date(user_text)
-            if is_valid:
-                processed_value = date_obj.strftime("%Y-%m-%d")
-                if "rental_end_date" in context.user_data:
-                    start_date = date_obj
-                    end_date = datetime.strptime(
-                        context.user_data["rental_end_date"], "%Y-%m-%d"
-                    ).date()
-                    context.user_data["rental_days"] = (end_date - start_date).days
-        elif field_to_edit == "rental_end_date":
-            is_valid, date_obj, error_message = validate_date(user_text)
-            if is_valid:
-                processed_value = date_obj.strftime("%Y-%m-%d")
-                if "rental_start_date" in context.user_data:
-                    end_date = date_obj
-                    start_date = datetime.strptime(
-                        context.user_data["rental_start_date"], "%Y-%m-%d"
-                    ).date()
-                    context.user_data["rental_days"] = (end_date - start_date).days
-        elif field_to_edit in [
-            "rental_amount",
-            "security_deposit",
-            "road_tax_amount",
-            "insurance_amount",
-            "sticker_amount",
-            "agreement_amount",
-            "puspakom_amount",
-        ]:
-            is_valid, price, error_message = validate_price(user_text)
-            if is_valid:
-                processed_value = price
-
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            context.user_data["editing_field"] = field_to_edit
-            return
-
-        context.user_data[field_to_edit] = processed_value
-        await update.message.reply_text(
-            f"✅ '{field_to_edit.replace('_', ' ').title()}' updated."
-        )
+    context.user_data[field_to_fill] = processed_value
+    context.user_data.pop("waiting_for_field", None)
+    await check_and_transition(update, context)
 
-        context.user_data.pop("temp_editing_field", None)
-        context.user_data["state"] = SELECTING_FIELD_TO_EDIT
-        reply_markup = build_edit_fields_keyboard(context.user_data)
-        await update.message.reply_text(
-            "You can edit another field or click 'Done Editing'.",
-            reply_markup=reply_markup,
-        )
-        return
 
-    if current_state == WAITING_FOR_LORRY_PRICE:
+@text_handler(EDITING_FIELD)
+async def _text_editing_field(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    field_to_edit = context.user_data.pop("editing_field", None)
+    if not field_to_edit:
+        await update.message.reply_text("An error occurred. Please start over.")
+        return await start_command(update, context)
+
+    is_valid, processed_value, error_message = True, user_text, ""
+
+    if field_to_edit == "truck_number":
+        is_valid, error_message = validate_truck_number(user_text)
+        if is_valid:
+            processed_value = user_text.strip().upper()
+    elif field_to_edit == "cust_contact":
+        is_valid, error_message = validate_phone_number(user_text)
+        if is_valid:
+            processed_value = user_text.strip()
+    elif field_to_edit == "rental_start_date":
+        is_valid, date_obj, error_message = validate_date(user_text)
+        if is_valid:
+            processed_value = date_obj.strftime("%Y-%m-%d")
+            if "rental_end_date" in context.user_data:
+                start_date = date_obj
+                end_date = datetime.strptime(
+                    context.user_data["rental_end_date"], "%Y-%m-%d"
+                ).date()
+                context.user_data["rental_days"] = (end_date - start_date).days
+    elif field_to_edit == "rental_end_date":
+        is_valid, date_obj, error_message = validate_date(user_text)
+        if is_valid:
+            processed_value = date_obj.strftime("%Y-%m-%d")
+            if "rental_start_date" in context.user_data:
+                end_date = date_obj
+                start_date = datetime.strptime(
+                    context.user_data["rental_start_date"], "%Y-%m-%d"
+                ).date()
+                context.user_data["rental_days"] = (end_date - start_date).days
+    elif field_to_edit in [
+        "rental_amount",
+        "security_deposit",
+        "road_tax_amount",
+        "insurance_amount",
+        "sticker_amount",
+        "agreement_amount",
+        "puspakom_amount",
+    ]:
         is_valid, price, error_message = validate_price(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+        if is_valid:
+            processed_value = price
 
-        description = context.user_data.get("lorry_sale_description", "Lorry")
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
+        context.user_data["editing_field"] = field_to_edit
+        return
 
-        # Create the line item
-        new_item = {
-            "qty": 1,
-            "line_description": description,
-            "unit_price": price,
-            "gl_code": get_gl_code_for_service(description),
-        }
+    context.user_data[field_to_edit] = processed_value
+    await update.message.reply_text(
+        f"✅ '{field_to_edit.replace('_', ' ').title()}' updated."
+    )
 
-        # Add to existing line items
-        line_items = context.user_data.get("line_items", [])
-        line_items.append(new_item)
-        context.user_data["line_items"] = line_items
+    context.user_data.pop("temp_editing_field", None)
+    context.user_data["state"] = SELECTING_FIELD_TO_EDIT
+    reply_markup = build_edit_fields_keyboard(context.user_data)
+    await update.message.reply_text(
+        "You can edit another field or click 'Done Editing'.",
+        reply_markup=reply_markup,
+    )
 
-        context.user_data["lorry_sale_item_created"] = True
-        await update.message.reply_text(f"✅ Lorry price set to RM {price:,.2f}.")
 
-        # Reset state and continue the flow
-        context.user_data["state"] = START
-        await check_and_transition(update, context)
+@text_handler(WAITING_FOR_LORRY_PRICE)
+async def _text_waiting_for_lorry_price(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, price, error_message = validate_price(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
         return
 
-    if current_state == AWAITING_ADDITIONAL_SERVICE_PRICE:
-        is_valid, price, error_message = validate_price(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+    description = context.user_data.get("lorry_sale_description", "Lorry")
+    _add_lorry_sale_item(context, description, price)
+    await update.message.reply_text(f"✅ Lorry price set to RM {price:,.2f}.")
 
-        service_name = context.user_data.get("awaiting_price_for_additional_service")
-        if not service_name:
-            await update.message.reply_text("An error occurred. Please start over.")
-            return await start_command(update, context)
+    # Reset state and continue the flow
+    context.user_data["state"] = START
+    await check_and_transition(update, context)
 
-        # Add new service
-        new_service_item = {
-            "qty": 1,
-            "line_description": service_name,
-            "unit_price": price,
-            "gl_code": get_gl_code_for_service(service_name),
-        }
 
-        service_line_items = context.user_data.get("service_line_items", [])
-        service_line_items.append(new_service_item)
-        context.user_data["service_line_items"] = service_line_items
+def _add_lorry_sale_item(context, description: str, price: float) -> None:
+    new_item = {
+        "qty": 1,
+        "line_description": description,
+        "unit_price": price,
+        "gl_code": get_gl_code_for_service(description),
+    }
 
-        await update.message.reply_text(
-            f"✅ Service '{service_name}' added with price RM {price:,.2f}."
-        )
+    # Add to existing line items
+    line_items = context.user_data.get("line_items", [])
+    line_items.append(new_item)
+    context.user_data["line_items"] = line_items
+    context.user_data["lorry_sale_item_created"] = True
 
-        # Re-show the items menu for the current category/sub-category
-        category = context.user_data.get("current_additional_category")
-        sub_category = context.user_data.get("current_additional_sub_category")
 
-        if not category:
-            # Fallback if context lost
-            context.user_data["state"] = SELECTING_ADDITIONAL_CATEGORY
-            reply_markup = build_additional_services_keyboard(context.user_data)
-            await update.message.reply_text(
-                "Service added. Please select a category to continue:",
-                reply_markup=reply_markup,
-            )
-            return
+@text_handler(AWAITING_ADDITIONAL_SERVICE_PRICE)
+async def _text_awaiting_additional_service_price(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, price, error_message = validate_price(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
+        return
 
-        skip_menu_subcats = [
-            "Body Repairs",
-            "Aircond",
-            "Wiring",
-            "Tyre Botak Tukar",
-            "Service",
-        ]
-        if sub_category in skip_menu_subcats:
-            # Return to Sub-Category Menu (Level 2)
-            reply_markup = build_additional_services_subcategory_keyboard(
-                category, context.user_data
-            )
-            await update.message.reply_text(
-                f"Select more services for {category}:", reply_markup=reply_markup
-            )
-            return
+    service_name = context.user_data.get("awaiting_price_for_additional_service")
+    if not service_name:
+        await update.message.reply_text("An error occurred. Please start over.")
+        return await start_command(update, context)
+
+    # Add new service
+    new_service_item = {
+        "qty": 1,
+        "line_description": service_name,
+        "unit_price": price,
+        "gl_code": get_gl_code_for_service(service_name),
+    }
 
-        context.user_data["state"] = SELECTING_ADDITIONAL_SUB_SERVICE
-        # Pass None for sub_category if it wasn't set (direct list case)
-        # But wait, build_additional_services_items_keyboard handles the logic.
-        # If we are here, we must know if it's a sub-category or not.
-        # Check logic.py logic again? No, we check structure.
+    service_line_items = context.user_data.get("service_line_items", [])
+    service_line_items.append(new_service_item)
+    context.user_data["service_line_items"] = service_line_items
 
-        # Actually, simpler: if sub_category is None, pass None.
-        reply_markup = build_additional_services_items_keyboard(
-            category, sub_category, context.user_data
-        )
+    await update.message.reply_text(
+        f"✅ Service '{service_name}' added with price RM {price:,.2f}."
+    )
 
-        label = sub_category if sub_category else category
+    # Re-show the items menu for the current category/sub-category
+    category = context.user_data.get("current_additional_category")
+    sub_category = context.user_data.get("current_additional_sub_category")
+
+    if not category:
+        # Fallback if context lost
+        context.user_data["state"] = SELECTING_ADDITIONAL_CATEGORY
+        reply_markup = build_additional_services_keyboard(context.user_data)
         await update.message.reply_text(
-            f"Select more services for {label} or go back:", reply_markup=reply_markup
+            "Service added. Please select a category to continue:",
+            reply_markup=reply_markup,
         )
         return
 
-    if current_state == AWAITING_CUSTOM_ADDITIONAL_SERVICE_NAME:
-        service_name = user_text.strip()
-        if not service_name:
-            await update.message.reply_text(
-                "Service name cannot be empty. Please try again:"
-            )
-            return
-
-        context.user_data["awaiting_price_for_additional_service"] = service_name
-        context.user_data["state"] = AWAITING_ADDITIONAL_SERVICE_PRICE
+    skip_menu_subcats = [
+        "Body Repairs",
+        "Aircond",
+        "Wiring",
+        "Tyre Botak Tukar",
+        "Service",
+    ]
+    if sub_category in skip_menu_subcats:
+        # Return to Sub-Category Menu (Level 2)
+        reply_markup = build_additional_services_subcategory_keyboard(
+            category, context.user_data
+        )
         await update.message.reply_text(
-            f"Please provide the price for '{service_name}':"
+            f"Select more services for {category}:", reply_markup=reply_markup
         )
         return
 
-    if current_state == COLLECTING_PHASE_AMOUNT:
-        is_valid, price, error_message = validate_price(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+    context.user_data["state"] = SELECTING_ADDITIONAL_SUB_SERVICE
+    # Pass None for sub_category if it wasn't set (direct list case)
+    # But wait, build_additional_services_items_keyboard handles the logic.
+    # If we are here, we must know if it's a sub-category or not.
+    # Check logic.py logic again? No, we check structure.
 
-        counter = context.user_data.get("payment_phase_counter", 1)
-        ordinal = to_ordinal(counter)
+    # Actually, simpler: if sub_category is None, pass None.
+    reply_markup = build_additional_services_items_keyboard(
+        category, sub_category, context.user_data
+    )
+
+    label = sub_category if sub_category else category
+    await update.message.reply_text(
+        f"Select more services for {label} or go back:", reply_markup=reply_markup
+    )
 
-        phases = context.user_data.get("payment_phases", [])
-        phases.append({"name": f"{ordinal} Payment", "amount": price, "remarks": ""})
-        context.user_data["payment_phases"] = phases
 
-        context.user_data["state"] = AWAITING_PAYMENT_PHASE_REMARKS
-        reply_markup = build_skip_keyboard()
+@text_handler(AWAITING_CUSTOM_ADDITIONAL_SERVICE_NAME)
+async def _text_awaiting_custom_additional_service_name(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    service_name = user_text.strip()
+    if not service_name:
         await update.message.reply_text(
-            f"✅ {ordinal} payment of RM {price:,.2f} added. Any remarks for this payment? (Optional, press Skip to leave blank)",
-            reply_markup=reply_markup,
+            "Service name cannot be empty. Please try again:"
         )
         return
 
-    if current_state == AWAITING_PAYMENT_PHASE_REMARKS:
-        remarks = user_text.strip()
-        phases = context.user_data.get("payment_phases", [])
-        if phases:
-            phases[-1]["remarks"] = remarks
+    context.user_data["awaiting_price_for_additional_service"] = service_name
+    context.user_data["state"] = AWAITING_ADDITIONAL_SERVICE_PRICE
+    await update.message.reply_text(
+        f"Please provide the price for '{service_name}':"
+    )
 
-        await update.message.reply_text("✅ Remarks added.")
 
-        context.user_data["payment_phase_counter"] += 1
+@text_handler(COLLECTING_PHASE_AMOUNT)
+async def _text_collecting_phase_amount(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, price, error_message = validate_price(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
+        return
 
-        # Recalculate to ensure ordering (1st, 2nd... Final)
-        recalculate_final_payment(context.user_data)
+    counter = context.user_data.get("payment_phase_counter", 1)
+    ordinal = to_ordinal(counter)
 
-        # Redirect to the review/edit menu instead of the 'What next' question
-        await ask_for_payment_phase_review(update, context)
-        return
+    phases = context.user_data.get("payment_phases", [])
+    phases.append({"name": f"{ordinal} Payment", "amount": price, "remarks": ""})
+    context.user_data["payment_phases"] = phases
 
-    if current_state == EDITING_PAYMENT_PHASE_AMOUNT:
-        is_valid, price, error_message = validate_price(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+    context.user_data["state"] = AWAITING_PAYMENT_PHASE_REMARKS
+    reply_markup = build_skip_keyboard()
+    await update.message.reply_text(
+        f"✅ {ordinal} payment of RM {price:,.2f} added. Any remarks for this payment? (Optional, press Skip to leave blank)",
+        reply_markup=reply_markup,
+    )
 
-        phase_index = context.user_data.pop("editing_payment_phase_index", None)
-        if phase_index is None:
-            await update.message.reply_text("An error occurred. Please start over.")
-            return await start_command(update, context)
 
-        phases = context.user_data.get("payment_phases", [])
-        phases[phase_index]["amount"] = price
+@text_handler(AWAITING_PAYMENT_PHASE_REMARKS)
+async def _text_awaiting_payment_phase_remarks(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    remarks = user_text.strip()
+    phases = context.user_data.get("payment_phases", [])
+    if phases:
+        phases[-1]["remarks"] = remarks
 
-        # Recalculate Final Payment after edit
-        recalculate_final_payment(context.user_data)
+    await update.message.reply_text("✅ Remarks added.")
 
-        await update.message.reply_text("✅ Amount updated and balance recalculated.")
-        await ask_for_payment_phase_review(update, context)  # Return to review menu
-        return
+    context.user_data["payment_phase_counter"] += 1
 
-    if current_state == EDITING_PAYMENT_PHASE_REMARKS:
-        remarks = user_text.strip()
-        phase_index = context.user_data.pop("editing_payment_phase_index", None)
-        if phase_index is None:
-            await update.message.reply_text("An error occurred. Please start over.")
-            return await start_command(update, context)
+    # Recalculate to ensure ordering (1st, 2nd... Final)
+    recalculate_final_payment(context.user_data)
 
-        phases = context.user_data.get("payment_phases", [])
-        phases[phase_index]["remarks"] = remarks
+    # Redirect to the review/edit menu instead of the 'What next' question
+    await ask_for_payment_phase_review(update, context)
 
-        # Recalculate Final Payment after edit
-        recalculate_final_payment(context.user_data)
 
-        await update.message.reply_text("✅ Remarks updated.")
-        await ask_for_payment_phase_review(update, context)  # Return to review menu
+@text_handler(EDITING_PAYMENT_PHASE_AMOUNT)
+async def _text_editing_payment_phase_amount(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, price, error_message = validate_price(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
         return
 
-    if current_state == WAITING_FOR_RENTAL_START_DATE:
-        is_valid, date_obj, error_message = validate_date(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+    phase_index = context.user_data.pop("editing_payment_phase_index", None)
+    if phase_index is None:
+        await update.message.reply_text("An error occurred. Please start over.")
+        return await start_command(update, context)
 
-        context.user_data["rental_start_date"] = date_obj.strftime("%Y-%m-%d")
-        context.user_data["state"] = WAITING_FOR_RENTAL_END_DATE
-        await update.message.reply_text(
-            "✅ Start date noted. Now, please provide the Rental End Date (YYYY-MM-DD):"
-        )
-        return
+    phases = context.user_data.get("payment_phases", [])
+    phases[phase_index]["amount"] = price
 
-    if current_state == WAITING_FOR_RENTAL_END_DATE:
-        is_valid, date_obj, error_message = validate_date(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+    # Recalculate Final Payment after edit
+    recalculate_final_payment(context.user_data)
 
-        context.user_data["rental_end_date"] = date_obj.strftime("%Y-%m-%d")
-        context.user_data["state"] = AWAITING_INFO
-        context.user_data["waiting_for_field"] = "rental_amount"
-        await update.message.reply_text(
-            "✅ End date noted. Now, please provide the rental amount:"
-        )
+    await update.message.reply_text("✅ Amount updated and balance recalculated.")
+    await ask_for_payment_phase_review(update, context)  # Return to review menu
+
+
+@text_handler(EDITING_PAYMENT_PHASE_REMARKS)
+async def _text_editing_payment_phase_remarks(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    remarks = user_text.strip()
+    phase_index = context.user_data.pop("editing_payment_phase_index", None)
+    if phase_index is None:
+        await update.message.reply_text("An error occurred. Please start over.")
+        return await start_command(update, context)
+
+    phases = context.user_data.get("payment_phases", [])
+    phases[phase_index]["remarks"] = remarks
+
+    # Recalculate Final Payment after edit
+    recalculate_final_payment(context.user_data)
+
+    await update.message.reply_text("✅ Remarks updated.")
+    await ask_for_payment_phase_review(update, context)  # Return to review menu
+
+
+@text_handler(WAITING_FOR_RENTAL_START_DATE)
+async def _text_waiting_for_rental_start_date(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, date_obj, error_message = validate_date(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
         return
 
-    if current_state == WAITING_FOR_CONTRACT_PERIOD:
-        context.user_data["contract_period"] = user_text
-        context.user_data["state"] = AWAITING_INFO
-        context.user_data["waiting_for_field"] = "rental_amount"
-        await update.message.reply_text(
-            f"✅ Contract period set to {user_text}. Now, please provide the monthly rental amount:"
-        )
+    context.user_data["rental_start_date"] = date_obj.strftime("%Y-%m-%d")
+    context.user_data["state"] = WAITING_FOR_RENTAL_END_DATE
+    await update.message.reply_text(
+        "✅ Start date noted. Now, please provide the Rental End Date (YYYY-MM-DD):"
+    )
+
+
+@text_handler(WAITING_FOR_RENTAL_END_DATE)
+async def _text_waiting_for_rental_end_date(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, date_obj, error_message = validate_date(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
         return
 
-    if current_state == EDITING_SERVICE_PRICE:
-        is_valid, price, error_message = validate_price(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+    context.user_data["rental_end_date"] = date_obj.strftime("%Y-%m-%d")
+    context.user_data["state"] = AWAITING_INFO
+    context.user_data["waiting_for_field"] = "rental_amount"
+    await update.message.reply_text(
+        "✅ End date noted. Now, please provide the rental amount:"
+    )
+
+
+@text_handler(WAITING_FOR_CONTRACT_PERIOD)
+async def _text_waiting_for_contract_period(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    context.user_data["contract_period"] = user_text
+    context.user_data["state"] = AWAITING_INFO
+    context.user_data["waiting_for_field"] = "rental_amount"
+    await update.message.reply_text(
+        f"✅ Contract period set to {user_text}. Now, please provide the monthly rental amount:"
+    )
+
+
+@text_handler(EDITING_SERVICE_PRICE)
+async def _text_editing_service_price(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, price, error_message = validate_price(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
+        return
 
-        service_name = context.user_data.pop("editing_service", None)
-        if not service_name:
-            await update.message.reply_text("An error occurred. Please start over.")
-            return await start_command(update, context)
-
-        # Update the price in the relevant list
-        found_and_updated = False
-        for item_list in ["service_line_items", "temp_service_line_items"]:
-            for item in context.user_data.get(item_list, []):
-                if item["line_description"] == service_name:
-                    item["unit_price"] = price
-                    found_and_updated = True
-                    break
-            if found_and_updated:
+    service_name = context.user_data.pop("editing_service", None)
+    if not service_name:
+        await update.message.reply_text("An error occurred. Please start over.")
+        return await start_command(update, context)
+
+    # Update the price in the relevant list
+    found_and_updated = False
+    for item_list in ["service_line_items", "temp_service_line_items"]:
+        for item in context.user_data.get(item_list, []):
+            if item["line_description"] == service_name:
+                item["unit_price"] = price
+                found_and_updated = True
                 break
+        if found_and_updated:
+            break
 
-        await update.message.reply_text(
-            f"✅ Price for '{service_name}' updated to RM {price:,.2f}."
-        )
+    await update.message.reply_text(
+        f"✅ Price for '{service_name}' updated to RM {price:,.2f}."
+    )
+
+    await ask_for_service_review(update, context)  # Return to review menu
 
-        await ask_for_service_review(update, context)  # Return to review menu
+
+@text_handler(AWAITING_SUB_SERVICE_PRICE)
+async def _text_awaiting_sub_service_price(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    is_valid, price, error_message = validate_price(user_text)
+    if not is_valid:
+        await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
         return
 
-    if current_state == AWAITING_SUB_SERVICE_PRICE:
-        is_valid, price, error_message = validate_price(user_text)
-        if not is_valid:
-            await update.message.reply_text(f"❌ {error_message}\n\nPlease try again:")
-            return
+    service_name = context.user_data.pop("awaiting_price_for_service", None)
+    if not service_name:
+        await update.message.reply_text("An error occurred. Please start over.")
+        return await start_command(update, context)
 
-        service_name = context.user_data.pop("awaiting_price_for_service", None)
-        if not service_name:
-            await update.message.reply_text("An error occurred. Please start over.")
-            return await start_command(update, context)
+    # Remove previous selection for the same main service
+    from services_config import SALES_SERVICES
 
-        # Remove previous selection for the same main service
-        from services_config import SALES_SERVICES
+    main_service_selection = context.user_data.get("main_service_selection")
+    if main_service_selection:
+        sub_services_to_remove = SALES_SERVICES.get(main_service_selection, [])
 
-        main_service_selection = context.user_data.get("main_service_selection")
-        if main_service_selection:
-            sub_services_to_remove = SALES_SERVICES.get(main_service_selection, [])
+        service_line_items = context.user_data.get("service_line_items", [])
+        service_line_items = [
+            item
+            for item in service_line_items
+            if item.get("line_description") not in sub_services_to_remove
+        ]
+        context.user_data["service_line_items"] = service_line_items
 
-            service_line_items = context.user_data.get("service_line_items", [])
-            service_line_items = [
-                item
-                for item in service_line_items
-                if item.get("line_description") not in sub_services_to_remove
-            ]
-            context.user_data["service_line_items"] = service_line_items
+    # Add new service
+    new_service_item = {
+        "qty": 1,
+        "line_description": service_name,
+        "unit_price": price,
+        "gl_code": get_gl_code_for_service(service_name),
+    }
 
-        # Add new service
-        new_service_item = {
-            "qty": 1,
-            "line_description": service_name,
-            "unit_price": price,
-            "gl_code": get_gl_code_for_service(service_name),
-        }
+    context.user_data.get("service_line_items", []).append(new_service_item)
 
-        context.user_data.get("service_line_items", []).append(new_service_item)
+    await update.message.reply_text(
+        f"✅ Service '{service_name}' added with price RM {price:,.2f}."
+    )
 
-        await update.message.reply_text(
-            f"✅ Service '{service_name}' added with price RM {price:,.2f}."
-        )
+    context.user_data["state"] = SELECTING_MAIN_SERVICE
+    context.user_data.pop("main_service_selection", None)
+    reply_markup = build_main_services_keyboard(context.user_data)
+    await update.message.reply_text(
+        "Please select another main service or click 'Done'.",
+        reply_markup=reply_markup,
+    )
 
-        context.user_data["state"] = SELECTING_MAIN_SERVICE
-        context.user_data.pop("main_service_selection", None)
-        reply_markup = build_main_services_keyboard(context.user_data)
+
+@text_handler(SELECTING_FIELD_TO_EDIT)
+async def _text_selecting_field_to_edit(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    await update.message.reply_text(
+        "Please use the buttons to edit fields or click 'Done Editing'."
+    )
+
+
+@text_handler(REVIEWING_LINE_ITEMS)
+async def _text_reviewing_line_items(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+):
+    # Handle text input during line item review (e.g., editing a field)
+    editing_item_index = context.user_data.get("editing_line_item_index")
+    editing_field = context.user_data.get("editing_line_item_field")
+
+    if editing_item_index is not None and editing_field:
+        line_items = context.user_data.get("line_items", [])
+        if 0 <= editing_item_index < len(line_items):
+            item = line_items[editing_item_index]
+            if editing_field == "description":
+                item["description"] = user_text
+            elif editing_field == "qty":
+                try:
+                    item["qty"] = int(user_text)
+                except ValueError:
+                    await update.message.reply_text(
+                        "Invalid quantity. Please enter a number."
+                    )
+                    return
+            elif editing_field == "unit_price":
+                is_valid, price, error_message = validate_price(user_text)
+                if not is_valid:
+                    await update.message.reply_text(
+                        f"❌ {error_message}\n\nPlease try again:"
+                    )
+                    return
+                item["unit_price"] = price
+
+            context.user_data.pop("editing_line_item_index")
+            context.user_data.pop("editing_line_item_field")
+            await update.message.reply_text("✅ Item updated.")
+            await ask_for_line_item_review(update, context)
+            return
+
+    await check_and_transition(update, context)
+
+
+def _pick_photo_size(sizes):
+    """
+    Returns the largest PhotoSize within MAX_PHOTO_BYTES, or None if every
+    size is over the limit. Sizes without a known file_size are accepted.
+    """
+    for photo in reversed(sizes):
+        if photo.file_size is None or photo.file_size <= MAX_PHOTO_BYTES:
+            return photo
+    return None
+
+
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    analyzing_msg = await update.message.reply_text("Analyzing the image... 📄")
+    context.user_data["confirmation_message_id"] = analyzing_msg.message_id
+    photo = _pick_photo_size(update.message.photo)
+    if photo is None:
         await update.message.reply_text(
-            "Please select another main service or click 'Done'.",
-            reply_markup=reply_markup,
+            "Sorry, that image is too large to analyze. Please send a smaller one."
         )
         return
 
-    if current_state == SELECTING_FIELD_TO_EDIT:
+    # Downloaded into memory; nothing is written to disk.
+    buffer = io.BytesIO()
+    photo_file = await photo.get_file()
+    await photo_file.download_to_memory(buffer)
+    if buffer.tell() > MAX_PHOTO_BYTES:
+        logger.warning(f"Downloaded photo is {buffer.tell()} bytes, over the limit.")
         await update.message.reply_text(
-            "Please use the buttons to edit fields or click 'Done Editing'."
+            "Sorry, that image is too large to analyze. Please send a smaller one."
         )
         return
+    buffer.seek(0)
 
-    if current_state == REVIEWING_LINE_ITEMS:
-        # Handle text input during line item review (e.g., editing a field)
-        editing_item_index = context.user_data.get("editing_line_item_index")
-        editing_field = context.user_data.get("editing_line_item_field")
-
-        if editing_item_index is not None and editing_field:
-            line_items = context.user_data.get("line_items", [])
-            if 0 <= editing_item_index < len(line_items):
-                item = line_items[editing_item_index]
-                if editing_field == "description":
-                    item["description"] = user_text
-                elif editing_field == "qty":
-                    try:
-                        item["qty"] = int(user_text)
-                    except ValueError:
-                        await update.message.reply_text(
-                            "Invalid quantity. Please enter a number."
-                        )
-                        return
-                elif editing_field == "unit_price":
-                    is_valid, price, error_message = validate_price(user_text)
-                    if not is_valid:
-                        await update.message.reply_text(
-                            f"❌ {error_message}\n\nPlease try again:"
-                        )
-                        return
-                    item["unit_price"] = price
-
-                context.user_data.pop("editing_line_item_index")
-                context.user_data.pop("editing_line_item_field")
-                await update.message.reply_text("✅ Item updated.")
-                await ask_for_line_item_review(update, context)
-                return
-
-    # Fallback for unhandled text, transition to check_and_transition
-    await check_and_transition(update, context)
+    with PIL.Image.open(buffer) as img:
+        # New single-step multimodal extraction
+        details = await extract_details_from_image(img)
 
+        # Always go to a review step to let the user see what the AI extracted
+        # and correct any "hallucinated" fields.
+        dump_debug(
+            logger, "Details from AI to be reviewed by user (from image):", details
+        )
 
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    analyzing_msg = await update.message.reply_text("Analyzing the image... 📄")
-    context.user_data["confirmation_message_id"] = analyzing_msg.message_id
-    photo_file = await update.message.photo[-1].get_file()
-    photo_path = None
-    try:
-        photo_path = await photo_file.download_to_drive()
-        with PIL.Image.open(photo_path) as img:
-            # New single-step multimodal extraction
-            details = await extract_details_from_image(img)
-
-            # Always go to a review step to let the user see what the AI extracted
-            # and correct any "hallucinated" fields.
-            logger.info(
-                f"DEBUG: Details from AI to be reviewed by user (from image): {json.dumps(details, indent=2, default=str)}"
+        if not details:
+            await update.message.reply_text(
+                "Sorry, I couldn't understand the image. Please provide details manually."
+            )
+            return
+        # The schema makes every field nullable; fields the model left empty
+        # must not hide the address and contact from the checks below.
+        details = {key: value for key, value in details.items() if value is not None}
+        # Line items follow LINE_ITEMS_SCHEMA; only their GL codes are added here.
+        for item in details.get("line_items") or []:
+            item["gl_code"] = get_gl_code_for_service(item.get("line_description", ""))
+
+        # --- Fix: Protect existing doc_type selection ---
+        if context.user_data.get("doc_type"):
+            # If user already selected a type (e.g., via button), don't let AI override it
+            details.pop("doc_type", None)
+            logger.info("Preserving user-selected doc_type, ignoring AI inference.")
+
+        # --- Fix: Handle Company Name/Address Confirmation ---
+        # Instead of auto-setting company_name, store it for confirmation
+        if details.get("company_name"):
+            prefetch_customer(update.effective_chat.id, details["company_name"])
+            context.user_data["is_company_name_from_image_extracted"] = True
+            context.user_data["extracted_image_company_name"] = details.pop(
+                "company_name"
             )
 
-            if not details:
-                await update.message.reply_text(
-                    "Sorry, I couldn't understand the image. Please provide details manually."
+            # Also temporarily store address/contact to go with the name
+            if "company_address" in details:
+                context.user_data["extracted_image_company_address"] = details.pop(
+                    "company_address"
                 )
-                return
-            if details.get("line_items"):
-                for item in details["line_items"]:
-                    # Robust key mapping
-                    if "description" in item and "line_description" not in item:
-                        item["line_description"] = item.pop("description")
-                    if "quantity" in item and "qty" not in item:
-                        item["qty"] = item.pop("quantity")
-
-                    desc = item.get("line_description")
-                    if desc:
-                        item["gl_code"] = get_gl_code_for_service(desc)
-
-            # --- Fix: Protect existing doc_type selection ---
-            if context.user_data.get("doc_type"):
-                # If user already selected a type (e.g., via button), don't let AI override it
-                details.pop("doc_type", None)
-                logger.info("Preserving user-selected doc_type, ignoring AI inference.")
-
-            # --- Fix: Handle Company Name/Address Confirmation ---
-            # Instead of auto-setting company_name, store it for confirmation
-            if "company_name" in details:
-                context.user_data["is_company_name_from_image_extracted"] = True
-                context.user_data["extracted_image_company_name"] = details.pop(
-                    "company_name"
+            if "cust_contact" in details:
+                context.user_data["extracted_image_cust_contact"] = details.pop(
+                    "cust_contact"
                 )
 
-                # Also temporarily store address/contact to go with the name
-                if "company_address" in details:
-                    context.user_data["extracted_image_company_address"] = details.pop(
-                        "company_address"
-                    )
-                if "cust_contact" in details:
-                    context.user_data["extracted_image_cust_contact"] = details.pop(
-                        "cust_contact"
-                    )
-
-            for key, value in details.items():
-                if value:
-                    context.user_data[key] = value
+        for key, value in details.items():
+            if value:
+                context.user_data[key] = value
 
-            # If it's a rental quote, ensure extracted fees are rebuilt into line items
-            if str(context.user_data.get("doc_type")).startswith("rental"):
-                rebuild_rental_fee_items(context)
+        # If it's a rental quote, ensure extracted fees are rebuilt into line items
+        if str(context.user_data.get("doc_type")).startswith("rental"):
+            rebuild_rental_fee_items(context)
 
-            await send_confirmation_message(update, context, is_review=True)
-    finally:
-        if photo_path and os.path.exists(str(photo_path)):
-            os.remove(str(photo_path))
+        await send_confirmation_message(update, context, is_review=True)
 
 
+@callback_router.route("review_")
 async def review_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -790,6 +974,7 @@ async def review_callback_handler(update: Update, context: ContextTypes.DEFAULT_
         )
 
 
+@callback_router.route("edit_")
 async def edit_selection_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -881,6 +1066,7 @@ async def edit_selection_callback_handler(
     )
 
 
+@callback_router.route("edit_value_", "remove_field_")
 async def field_edit_options_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -961,6 +1147,7 @@ async def field_edit_options_callback_handler(
         )
 
 
+@callback_router.route("main_service_")
 async def main_service_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -968,9 +1155,7 @@ async def main_service_callback_handler(
     await query.answer()
     data = query.data.replace("main_service_", "")
 
-    state_history = context.user_data.get("state_history", [])
-    state_history.append(context.user_data.get("state"))
-    context.user_data["state_history"] = state_history
+    get_state_history(context.user_data).append(context.user_data.get("state"))
 
     if data == "tukar_nama":
         context.user_data["state"] = SELECTING_SUB_SERVICE
@@ -1056,13 +1241,14 @@ async def main_service_callback_handler(
             await show_additional_services(update, context)
 
     elif data == "back":  # From sub-menus to main services
-        state_history = context.user_data.get("state_history", [])
+        state_history = get_state_history(context.user_data)
         if state_history:
             previous_state = state_history.pop()
             context.user_data["state"] = previous_state
         await check_and_transition(update, context)
 
 
+@callback_router.route("sub_service_")
 async def sub_service_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1070,15 +1256,14 @@ async def sub_service_callback_handler(
     await query.answer()
     data = query.data.replace("sub_service_", "")
 
-    state_history = context.user_data.get("state_history", [])
-    state_history.append(context.user_data.get("state"))
-    context.user_data["state_history"] = state_history
+    get_state_history(context.user_data).append(context.user_data.get("state"))
 
     context.user_data["awaiting_price_for_service"] = data
     context.user_data["state"] = AWAITING_SUB_SERVICE_PRICE
     await query.edit_message_text(f"Please provide the price for '{data}':")
 
 
+@callback_router.route("additional_")
 async def additional_service_navigation_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1287,6 +1472,7 @@ async def additional_service_navigation_handler(
         return
 
 
+@callback_router.route("company_")
 async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1305,6 +1491,7 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
         await check_and_transition(update, context)
 
 
+@callback_router.route("final_confirm_")
 async def final_confirmation_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1343,6 +1530,7 @@ async def final_confirmation_handler(
         )
 
 
+@callback_router.route("add_new_")
 async def add_new_detail_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1366,6 +1554,7 @@ async def add_new_detail_callback_handler(
         )
 
 
+@callback_router.route("lorry_sale_type_")
 async def lorry_sale_type_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1373,12 +1562,25 @@ async def lorry_sale_type_callback_handler(
     await query.answer()
     description = query.data.replace("lorry_sale_type_", "")
     context.user_data["lorry_sale_description"] = description
+
+    # The price may already have come with the first message.
+    price = context.user_data.pop("lorry_price", None)
+    if price is not None:
+        _add_lorry_sale_item(context, description, price)
+        await query.edit_message_text(
+            text=f"{description}. ✅ Lorry price set to RM {price:,.2f}."
+        )
+        context.user_data["state"] = START
+        await check_and_transition(update, context)
+        return
+
     context.user_data["state"] = WAITING_FOR_LORRY_PRICE
     await query.edit_message_text(
         text=f"{description}. Now, please provide the price for the lorry."
     )
 
 
+@callback_router.route("payment_phase_")
 async def payment_phase_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1434,6 +1636,7 @@ async def payment_phase_callback_handler(
         context.user_data["state"] = COLLECTING_PHASE_AMOUNT
 
 
+@callback_router.route("rental_period_", "rental_equip_")
 async def rental_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1475,6 +1678,7 @@ async def rental_callback_handler(update: Update, context: ContextTypes.DEFAULT_
         await query.edit_message_reply_markup(reply_markup=reply_markup)
 
 
+@callback_router.route("contract_period_")
 async def contract_period_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1494,6 +1698,7 @@ async def contract_period_callback_handler(
         )
 
 
+@callback_router.route("remove_item_")
 async def remove_items_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1593,6 +1798,7 @@ async def remove_items_callback_handler(
         await query.message.reply_text(f"❌ An error occurred: {str(e)}")
 
 
+@callback_router.route("clarify_")
 async def price_clarification_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1610,6 +1816,7 @@ async def price_clarification_callback_handler(
     await ask_for_price_clarification(update, context)
 
 
+@callback_router.route("use_", "select_matched_customer_")
 async def customer_flow_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1617,8 +1824,12 @@ async def customer_flow_callback_handler(
     await query.answer()
     data = query.data
     if data.startswith("select_matched_customer_"):
-        matched_name = data.replace("select_matched_customer_", "")
-        context.user_data["matched_customer_name"] = matched_name
+        index = int(data.replace("select_matched_customer_", ""))
+        matched_names = context.user_data.get("matched_customer_names", [])
+        if index < len(matched_names):
+            context.user_data["matched_customer_name"] = matched_names[index]
+        else:
+            context.user_data.pop("matched_customer_name", None)
         data = "use_existing_customer"
     if data == "use_existing_customer":
         matched_name = context.user_data.get("matched_customer_name")
@@ -1656,6 +1867,7 @@ async def customer_flow_callback_handler(
         await check_and_transition(update, context)
 
 
+@callback_router.route("confirm_company_name_")
 async def confirm_company_name_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1705,6 +1917,7 @@ async def confirm_company_name_callback_handler(
     await check_and_transition(update, context)
 
 
+@callback_router.route("post_generation_")
 async def post_generation_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1736,6 +1949,7 @@ async def post_generation_callback_handler(
         await start_command(update, context)
 
 
+@callback_router.route("rental_price_", "rental_included_", "rental_skip_")
 async def rental_fee_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -1813,11 +2027,12 @@ async def rental_fee_callback_handler(
         )
 
 
+@callback_router.route(exact="back")
 async def back_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    state_history = context.user_data.get("state_history", [])
+    state_history = get_state_history(context.user_data)
     if state_history:
         # Pop the current state
         state_history.pop()
@@ -1835,133 +2050,84 @@ async def back_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def master_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    data = query.data
 
     # Push current state to history before processing new callback if different from last
-    state_history = context.user_data.get("state_history", [])
+    get_state_history(context.user_data).push(context.user_data.get("state"))
+
+    if not await callback_router.dispatch(update, context):
+        # A simple fallback for unhandled callbacks
+        logger.warning(f"Unhandled callback query with data: {query.data}")
+        await query.answer("Action not recognized.")
+
+
+@callback_router.route(exact="skip")
+async def skip_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
     current_state = context.user_data.get("state")
-    if not state_history or state_history[-1] != current_state:
-        state_history.append(current_state)
-    context.user_data["state_history"] = state_history
+    field_to_skip = context.user_data.pop("waiting_for_field", None)
+    if field_to_skip:
+        context.user_data[field_to_skip] = "N/A"
+        await query.edit_message_text(f"✅ Skipped {field_to_skip.replace('_', ' ')}.")
+        await check_and_transition(update, context)
+    elif current_state == AWAITING_PAYMENT_PHASE_REMARKS:
+        phases = context.user_data.get("payment_phases", [])
+        if phases:
+            phases[-1]["remarks"] = ""
 
-    if data == "back":
-        await back_callback_handler(update, context)
-        return
+        await query.edit_message_text("✅ Remarks skipped.")
 
-    if data == "skip":
-        await query.answer()
-        field_to_skip = context.user_data.pop("waiting_for_field", None)
-        if field_to_skip:
-            context.user_data[field_to_skip] = "N/A"
-            await query.edit_message_text(
-                f"✅ Skipped {field_to_skip.replace('_', ' ')}."
-            )
-            await check_and_transition(update, context)
-            return
-        elif context.user_data.get("state") == AWAITING_PAYMENT_PHASE_REMARKS:
-            phases = context.user_data.get("payment_phases", [])
-            if phases:
-                phases[-1]["remarks"] = ""
+        context.user_data["payment_phase_counter"] += 1
 
-            await query.edit_message_text("✅ Remarks skipped.")
+        # Recalculate to ensure ordering (1st, 2nd... Final)
+        recalculate_final_payment(context.user_data)
 
-            context.user_data["payment_phase_counter"] += 1
+        # Redirect to the review/edit menu instead of the 'What next' question
+        await ask_for_payment_phase_review(update, context)
+    else:
+        logger.warning(f"Skip pressed in unexpected state: {current_state}")
+        await query.edit_message_text("Nothing to skip here.")
+        await check_and_transition(update, context)
 
-            # Recalculate to ensure ordering (1st, 2nd... Final)
-            recalculate_final_payment(context.user_data)
 
-            # Redirect to the review/edit menu instead of the 'What next' question
-            await ask_for_payment_phase_review(update, context)
-            return
-        else:
-            logger.warning(f"Skip pressed in unexpected state: {current_state}")
-            await query.edit_message_text("Nothing to skip here.")
-            await check_and_transition(update, context)
-            return
+@callback_router.route("edit_service_price_")
+async def edit_service_price_callback_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+):
+    query = update.callback_query
+    service_name = query.data.replace("edit_service_price_", "")
+    context.user_data["editing_service"] = service_name
+    context.user_data["state"] = EDITING_SERVICE_PRICE
+    await query.edit_message_text(
+        text=f"Please provide the new price for '{service_name}':"
+    )
 
-    if data.startswith("doc_type_"):
-        await doc_type_callback_handler(update, context)
-    elif data.startswith("review_item_"):
-        await line_item_review_callback_handler(update, context)
-    elif data.startswith("edit_item_field_"):
-        await line_item_field_edit_callback_handler(update, context)
-    elif data.startswith("review_"):
-        await review_callback_handler(update, context)
-    elif data.startswith("edit_payment_phase_") or data.startswith(
-        "remove_payment_phase_"
-    ):
-        await edit_payment_phase_options_callback_handler(update, context)
-    elif data.startswith("edit_value_") or data.startswith("remove_field_"):
-        await field_edit_options_callback_handler(update, context)
-    elif data.startswith("edit_service_price_"):
-        service_name = data.replace("edit_service_price_", "")
-        context.user_data["editing_service"] = service_name
-        context.user_data["state"] = EDITING_SERVICE_PRICE
-        await query.edit_message_text(
-            text=f"Please provide the new price for '{service_name}':"
-        )
-    elif data.startswith("remove_service_"):
-        service_name = data.replace("remove_service_", "")
-
-        # Remove from selected services
-        selected_services = context.user_data.get("selected_services", [])
-        if service_name in selected_services:
-            selected_services.remove(service_name)
-        context.user_data["selected_services"] = selected_services
-
-        # Remove from priced items
-        for item_list_name in ["service_line_items", "temp_service_line_items"]:
-            item_list = context.user_data.get(item_list_name, [])
-            context.user_data[item_list_name] = [
-                item for item in item_list if item["line_description"] != service_name
-            ]
 
-        await query.edit_message_text(text=f"✅ Service '{service_name}' removed.")
-        await ask_for_service_review(update, context)  # Return to review menu
-    elif data.startswith("edit_"):
-        await edit_selection_callback_handler(update, context)
-    elif data.startswith("company_"):
-        await button_callback_handler(update, context)
-    elif data.startswith("final_confirm_"):
-        await final_confirmation_handler(update, context)
-    elif data.startswith("add_new_"):
-        await add_new_detail_callback_handler(update, context)
-    elif data.startswith("lorry_sale_type_"):
-        await lorry_sale_type_callback_handler(update, context)
-    elif data.startswith("payment_phase_"):
-        await payment_phase_callback_handler(update, context)
-    elif (
-        data.startswith("rental_price_")
-        or data.startswith("rental_included_")
-        or data.startswith("rental_skip_")
-    ):
-        await rental_fee_callback_handler(update, context)
-    elif data.startswith("rental_period_") or data.startswith("rental_equip_"):
-        await rental_callback_handler(update, context)
-    elif data.startswith("contract_period_"):
-        await contract_period_callback_handler(update, context)
-    elif data.startswith("remove_item_"):
-        await remove_items_callback_handler(update, context)
-    elif data.startswith("clarify_"):
-        await price_clarification_callback_handler(update, context)
-    elif data.startswith("use_") or data.startswith("select_matched_customer_"):
-        await customer_flow_callback_handler(update, context)
-    elif data.startswith("confirm_company_name_"):
-        await confirm_company_name_callback_handler(update, context)
-    elif data.startswith("post_generation_"):
-        await post_generation_callback_handler(update, context)
-    elif data.startswith("main_service_"):
-        await main_service_callback_handler(update, context)
-    elif data.startswith("sub_service_"):
-        await sub_service_callback_handler(update, context)
-    elif data.startswith("additional_"):
-        await additional_service_navigation_handler(update, context)
-    else:
-        # A simple fallback for unhandled callbacks
-        logger.warning(f"Unhandled callback query with data: {data}")
-        await query.answer("Action not recognized.")
+@callback_router.route("remove_service_")
+async def remove_service_callback_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+):
+    query = update.callback_query
+    service_name = query.data.replace("remove_service_", "")
+
+    # Remove from selected services
+    selected_services = context.user_data.get("selected_services", [])
+    if service_name in selected_services:
+        selected_services.remove(service_name)
+    context.user_data["selected_services"] = selected_services
+
+    # Remove from priced items
+    for item_list_name in ["service_line_items", "temp_service_line_items"]:
+        item_list = context.user_data.get(item_list_name, [])
+        context.user_data[item_list_name] = [
+            item for item in item_list if item["line_description"] != service_name
+        ]
+
+    await query.edit_message_text(text=f"✅ Service '{service_name}' removed.")
+    await ask_for_service_review(update, context)  # Return to review menu
 
 
+@callback_router.route("doc_type_")
 async def doc_type_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1971,6 +2137,7 @@ async def doc_type_callback_handler(update: Update, context: ContextTypes.DEFAUL
     await check_and_transition(update, context)
 
 
+@callback_router.route("edit_payment_phase_", "remove_payment_phase_")
 async def edit_payment_phase_options_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -2019,6 +2186,7 @@ async def edit_payment_phase_options_callback_handler(
         await ask_for_payment_phase_review(update, context)
 
 
+@callback_router.route("review_item_")
 async def line_item_review_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -2064,6 +2232,7 @@ async def line_item_review_callback_handler(
         await check_and_transition(update, context)
 
 
+@callback_router.route("edit_item_field_")
 async def line_item_field_edit_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
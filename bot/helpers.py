@@ -4,27 +4,73 @@ import logging
 import json
 import mimetypes
 import base64
+import os
 from datetime import datetime
 from typing import Union
 
+from quote_models import gl_code_for
+from .cache import TTLCache
+from .http_client import get_http_client
+from . import prefetch
+
 logger = logging.getLogger(__name__)
 
-CUSTOMERS_API_URL = "http://127.0.0.1:8000/api/search_customer/"
+CUSTOMERS_API_URL = os.getenv(
+    "CUSTOMERS_API_URL", "http://127.0.0.1:8000/api/search_customer/"
+)
+
+# Recent customer lookups. Names without a match are cached for a shorter time
+# so a customer created elsewhere shows up again soon.
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", "600"))
+CUSTOMER_CACHE_NEGATIVE_TTL = float(os.getenv("CUSTOMER_CACHE_NEGATIVE_TTL", "60"))
+_customer_cache = TTLCache(maxsize=512, ttl=CUSTOMER_CACHE_TTL)
+
+def _customer_cache_key(name: str) -> str:
+    return " ".join(str(name).split()).casefold()
 
 
 async def search_customer_by_name(name: str) -> dict:
-    """Searches for a customer by name via the new API endpoint asynchronously."""
+    """
+    Searches for a customer by name via the API endpoint asynchronously.
+    Results, including empty ones, are cached for a while so repeat
+    customers resolve without a network round trip.
+    """
+    cache_key = _customer_cache_key(name)
+    cached = _customer_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Customer lookup for '{name}' served from cache.")
+        return cached
+
     logger.info(f"Searching for customer '{name}' via API...")
     try:
-        search_url = f"{CUSTOMERS_API_URL}?name={name}"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(search_url, timeout=30)
-            response.raise_for_status()
-            return response.json()
-    except httpx.RequestError as e:
+        client = get_http_client()
+        response = await client.get(CUSTOMERS_API_URL, params={"name": name})
+        response.raise_for_status()
+        result = response.json()
+    except httpx.HTTPError as e:
+        # Errors are not cached, the next lookup tries the API again.
         logger.error(f"API error while searching for customer '{name}': {e}")
         return {}
 
+    _customer_cache.set(
+        cache_key, result, ttl=None if result else CUSTOMER_CACHE_NEGATIVE_TTL
+    )
+    return result
+
+
+def prefetch_customer(chat_id: int, name: str) -> None:
+    """Starts looking up a customer name in the background for a chat."""
+    if name:
+        key = _customer_cache_key(name)
+        prefetch.prefetch(chat_id, "customer", key, search_customer_by_name, name)
+
+
+async def lookup_customer(chat_id: int, name: str) -> dict:
+    """Returns search_customer_by_name(name), using the chat's prefetch if any."""
+    return await prefetch.consume(
+        chat_id, "customer", _customer_cache_key(name), search_customer_by_name, name
+    )
+
 
 def to_ordinal(n):
     """Converts an integer to its ordinal string form (e.g., 1 -> 1st, 2 -> 2nd)."""
@@ -49,16 +95,7 @@ def get_display_value(value, is_price=False):
 
 def get_gl_code_for_service(service_description: str) -> str:
     """Returns the correct GL code based on the service description."""
-    from services_config import (
-        GL_CODE_MAPPING,
-    )  # Import here to avoid circular dependency with logic.py
-
-    desc = service_description.lower()
-    for keyword, gl_code in GL_CODE_MAPPING.items():
-        if keyword in desc:
-            return gl_code
-    # Default GL code for any unmatched service
-    return "501-000"
+    return gl_code_for(service_description)
 
 
 def validate_truck_number(truck_number: str) -> tuple[bool, str]:
@@ -0,0 +1,71 @@
+# bot/http_client.py
+import logging
+import os
+
+import httpx
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Connection pool and timeout settings for calls to our own API.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+_client = None
+
+
+class _ConnectionTrace:
+    """httpcore trace hook that notes whether a request opened a new connection."""
+
+    __slots__ = ("new_connection",)
+
+    def __init__(self):
+        self.new_connection = False
+
+    async def __call__(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connection = True
+
+
+async def _on_request(request: httpx.Request) -> None:
+    request.extensions["trace"] = _ConnectionTrace()
+
+
+async def _on_response(response: httpx.Response) -> None:
+    trace = response.request.extensions.get("trace")
+    if not isinstance(trace, _ConnectionTrace):
+        return
+    connection = "new" if trace.new_connection else "reused"
+    metrics.incr(f"http.connections.{connection}")
+    logger.info(
+        f"{response.request.method} {response.request.url.path} -> "
+        f"{response.status_code} ({connection} connection)"
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared keep-alive client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            event_hooks={"request": [_on_request], "response": [_on_response]},
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """Closes the shared client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,54 @@
+# bot/imaging.py
+import io
+import logging
+import os
+
+import PIL.Image
+import PIL.ImageOps
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Photos are scaled down so their longest edge is at most IMAGE_MAX_EDGE
+# pixels, then re-encoded as IMAGE_FORMAT ("JPEG" or "WEBP") at IMAGE_QUALITY.
+# 1600px keeps number plates and business-card text readable.
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def prepare_image(
+    image: PIL.Image.Image,
+    max_edge: int = IMAGE_MAX_EDGE,
+    image_format: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+) -> dict:
+    """
+    Downscales and re-encodes an image for upload to Gemini. Returns an
+    inline blob ({"mime_type": ..., "data": ...}) the API accepts in place
+    of a PIL image.
+    """
+    with metrics.timed("image.prepare"):
+        original_size = image.size
+        # Apply the camera's EXIF rotation so text is upright.
+        prepared = PIL.ImageOps.exif_transpose(image)
+        if prepared.mode not in ("RGB", "L"):
+            prepared = prepared.convert("RGB")
+        if max(prepared.size) > max_edge:
+            if prepared is image:
+                prepared = prepared.copy()
+            prepared.thumbnail((max_edge, max_edge), PIL.Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        prepared.save(buffer, format=image_format, quality=quality, optimize=True)
+        data = buffer.getvalue()
+
+    metrics.incr("image.bytes_sent", len(data))
+    logger.info(
+        f"Prepared image {original_size[0]}x{original_size[1]} -> "
+        f"{prepared.size[0]}x{prepared.size[1]} {image_format}, {len(data)} bytes."
+    )
+    return {"mime_type": _MIME_TYPES.get(image_format, "image/jpeg"), "data": data}
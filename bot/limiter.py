@@ -0,0 +1,153 @@
+# bot/limiter.py
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from log_utils import current_chat_id
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# At most GEMINI_MAX_CONCURRENCY Gemini requests run at once, and no more than
+# GEMINI_REQUESTS_PER_MINUTE start per minute (0 disables the rate limit),
+# with bursts of up to GEMINI_BURST requests.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", str(GEMINI_MAX_CONCURRENCY)))
+
+# Called (and awaited) with the number of requests ahead when a request has
+# to wait, e.g. to tell the user. Set per update by the update processor.
+on_queued = contextvars.ContextVar("on_queued", default=None)
+
+
+class FairLimiter:
+    """
+    Caps concurrent requests and their start rate (token bucket). Waiting
+    requests are queued per chat and served round-robin between chats, so
+    one chat sending many photos cannot hold up the others.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        requests_per_minute: float = 0,
+        burst: int = 1,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.rate = requests_per_minute / 60
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._active = 0
+        self._waiting = 0
+        # chat -> deque of futures; the first chat is the next one served.
+        self._queues = OrderedDict()
+        self._wakeup = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._refilled_at) * self.rate
+            )
+        self._refilled_at = now
+
+    def _try_start(self) -> bool:
+        """Takes a concurrency slot and a token if both are available."""
+        if self._active >= self.max_concurrency:
+            return False
+        if self.rate:
+            self._refill()
+            if self._tokens < 1:
+                self._schedule_wakeup((1 - self._tokens) / self.rate)
+                return False
+            self._tokens -= 1
+        self._active += 1
+        return True
+
+    def _schedule_wakeup(self, delay: float) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Starts queued requests, taking one chat at a time in turn."""
+        while self._queues:
+            chat, queue = next(iter(self._queues.items()))
+            while queue and queue[0].done():  # cancelled while waiting
+                queue.popleft()
+            if not queue:
+                del self._queues[chat]
+                continue
+            if not self._try_start():
+                return
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(chat)
+            else:
+                del self._queues[chat]
+            future.set_result(None)
+
+    async def acquire(self, chat=None) -> None:
+        """Waits for a slot; chat defaults to the chat of the current update."""
+        if not self._queues and self._try_start():
+            return
+
+        chat = current_chat_id.get() if chat is None else chat
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat, deque()).append(future)
+        self._waiting += 1
+        metrics.incr(f"{self.name}.queued")
+        logger.info(f"{self.name}: request queued ({self._waiting} waiting).")
+
+        started = time.perf_counter()
+        try:
+            callback = on_queued.get()
+            if callback is not None:
+                try:
+                    await callback(self._waiting - 1)
+                except Exception as e:
+                    logger.warning(f"{self.name}: queued notification failed: {e}")
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled.
+                self.release()
+            else:
+                future.cancel()
+                self._waiting -= 1
+            raise
+        finally:
+            metrics.observe(f"{self.name}.queue_wait", time.perf_counter() - started)
+
+    def release(self) -> None:
+        self._active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, chat=None):
+        """Holds a slot for the duration of the block."""
+        await self.acquire(chat)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+gemini_limiter = FairLimiter(
+    "gemini",
+    GEMINI_MAX_CONCURRENCY,
+    requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+    burst=GEMINI_BURST,
+)
@@ -1,10 +1,8 @@
 import logging
-import json
 import os
-import httpx  # Changed from requests
-from datetime import datetime, date
+from dataclasses import asdict
+from datetime import datetime
 import telegram
-from typing import Union
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
@@ -13,11 +11,14 @@ from telegram.ext import ContextTypes
 from .constants import *
 from .helpers import (
     get_display_value,
-    search_customer_by_name,
+    lookup_customer,
     validate_date,
-    get_gl_code_for_service,
 )
+from .http_client import get_http_client
 from .templates import build_confirmation_text, missing_field_prompt
+from log_utils import dump_debug
+from quote_models import QuoteDraft, discard_transient
+from . import flow
 from .keyboards import (
     build_doc_type_keyboard,
     build_review_keyboard,
@@ -91,9 +92,10 @@ async def check_customer_in_database(
         await check_and_transition(update, context)
         return
 
-    found_customers = await search_customer_by_name(
-        user_provided_name
-    )  # Await the async call
+    # Usually already looked up in the background while the user reviewed.
+    found_customers = await lookup_customer(
+        update.effective_chat.id, user_provided_name
+    )
 
     if found_customers and "error" not in found_customers:
         logger.info(
@@ -123,13 +125,17 @@ async def check_customer_in_database(
                 reply_markup=reply_markup,
             )
         else:
+            # Names can exceed Telegram's 64-byte callback_data limit, so the
+            # buttons carry an index into this list instead.
+            matched_names = list(found_customers.keys())
+            context.user_data["matched_customer_names"] = matched_names
             keyboard = [
                 [
                     InlineKeyboardButton(
-                        name, callback_data=f"select_matched_customer_{name}"
+                        name, callback_data=f"select_matched_customer_{index}"
                     )
                 ]
-                for name in found_customers.keys()
+                for index, name in enumerate(matched_names)
             ]
             keyboard.append(
                 [
@@ -342,12 +348,12 @@ def rebuild_rental_fee_items(context: ContextTypes.DEFAULT_TYPE):
     context.user_data["service_line_items"] = filtered_service_line_items
     context.user_data["excluded_line_items"] = excluded_line_items
 
-    logger.info("--- Rebuild Rental Fees ---")
     logger.info(
-        f"Service Line Items: {json.dumps(filtered_service_line_items, indent=2)}"
+        f"Rebuilt rental fees: {len(filtered_service_line_items)} service item(s), "
+        f"{len(excluded_line_items)} excluded item(s)."
     )
-    logger.info(f"Excluded Line Items: {json.dumps(excluded_line_items, indent=2)}")
-    logger.info("---------------------------")
+    dump_debug(logger, "Rental service line items:", filtered_service_line_items)
+    dump_debug(logger, "Rental excluded line items:", excluded_line_items)
 
 
 async def ask_for_next_rental_fee(
@@ -526,17 +532,6 @@ async def send_confirmation_message(
     logger.info(f"New confirmation message sent with ID: {sent_message.message_id}")
 
 
-def _clean_amount_string(amount_str: Union[str, float]) -> float:
-    """Removes commas from amount strings and converts to float."""
-    if isinstance(amount_str, float):
-        return amount_str
-    try:
-        return float(str(amount_str).replace(",", ""))
-    except (ValueError, TypeError) as e:
-        logger.warning(f"Could not convert '{amount_str}' to float: {e}")
-        return 0.0
-
-
 async def dispatch_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Dispatches the final payload to the API."""
     chat_id = update.effective_chat.id
@@ -555,10 +550,7 @@ async def dispatch_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         description = f"{doc_type.capitalize()} Quotation for truck {data.get('truck_number', '')}"
 
     # Log the full user_data context for debugging
-    logger.info(
-        "--- DISPATCHING REQUEST: FULL USER_DATA ---\n%s",
-        json.dumps(data, indent=2, default=str),
-    )
+    dump_debug(logger, "--- DISPATCHING REQUEST: FULL USER_DATA ---", data)
 
     # --- New: Dynamic Prefix Generation ---
     issuing_company_name = data.get("issuing_company", "Unique Enterprise").upper()
@@ -582,151 +574,26 @@ async def dispatch_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     # Construct the doc_no
     doc_no = f"{company_prefix}{doc_type_prefix}-{truck_num_part}-{date_part}"
 
-    # Clean up customer address to remove extra blank lines
-    company_address = data.get("company_address", "")
-    cleaned_address = "\n".join(
-        [line.strip() for line in company_address.split("\n") if line.strip()]
+    draft = QuoteDraft.from_user_data(
+        data,
+        doc_no=doc_no,
+        description=description,
+        issuing_company=issuing_company_name,
+        is_proforma=is_proforma,
     )
+    payload = asdict(draft)
+    discard_transient(data)
+    logger.info(f"Dispatching {doc_type} quote {doc_no}.")
 
-    payload = {
-        "type": doc_type,
-        "cust_code": "300-C0002",
-        "cust_name": data.get("company_name", "CASH SALE"),
-        "company_address": cleaned_address,
-        "cust_contact": data.get("cust_contact", ""),
-        "truck_number": data.get("truck_number", ""),
-        "issuing_company": issuing_company_name,
-        "doc_no": doc_no,
-        "description": description,
-        "salesperson": data.get("salesperson"),
-        "payment_phases": data.get("payment_phases", []),
-        "is_proforma": is_proforma,
-    }
-
-    # Normalize and filter line items
-    raw_line_items = data.get("line_items", [])
-    line_items = []
-    for item in raw_line_items:
-        if isinstance(item, dict):
-            # Handle both 'description' and 'line_description'
-            desc = item.get("line_description") or item.get("description")
-            if desc:
-                line_items.append(
-                    {
-                        "qty": item.get("qty", 1),
-                        "line_description": desc,
-                        "unit_price": _clean_amount_string(item.get("unit_price", 0)),
-                        "gl_code": item.get("gl_code")
-                        or get_gl_code_for_service(desc)
-                        or "501-000",
-                    }
-                )
-
-    raw_service_items = data.get("service_line_items", [])
-    service_line_items = []
-    for item in raw_service_items:
-        if isinstance(item, dict):
-            desc = item.get("line_description") or item.get("description")
-            if desc:
-                service_line_items.append(
-                    {
-                        "qty": item.get("qty", 1),
-                        "line_description": desc,
-                        "unit_price": _clean_amount_string(item.get("unit_price", 0)),
-                        "gl_code": item.get("gl_code")
-                        or get_gl_code_for_service(desc)
-                        or "501-000",
-                    }
-                )
-
-    raw_excluded_items = data.get("excluded_line_items", [])
-    excluded_line_items = []
-    for item in raw_excluded_items:
-        if isinstance(item, dict):
-            desc = item.get("line_description") or item.get("description")
-            if desc:
-                excluded_line_items.append(
-                    {
-                        "qty": item.get("qty", 1),
-                        "line_description": desc,
-                        "unit_price": _clean_amount_string(item.get("unit_price", 0)),
-                        "gl_code": item.get("gl_code")
-                        or get_gl_code_for_service(desc)
-                        or "501-000",
-                    }
-                )
-
-    # Update the payload with normalized lists
-    payload["line_items"] = line_items
-    payload["service_line_items"] = service_line_items
-    payload["excluded_line_items"] = excluded_line_items
-
-    # Total amount calculation
-    total_amount = sum(item["unit_price"] * item["qty"] for item in line_items)
-    total_amount += sum(item["unit_price"] * item["qty"] for item in service_line_items)
-
-    if doc_type.startswith("rental"):
-        if "rental_amount" in data:
-            rental_desc = "Monthly Rental"
-            if data.get("rental_period_type") == "daily":
-                days = data.get("rental_days", "N/A")
-                start_date = data.get("rental_start_date", "N/A")
-                end_date = data.get("rental_end_date", "N/A")
-                rental_desc = f"{start_date} to {end_date} ({days} Days)"
-
-            payload["main_rental_item"] = {
-                "qty": 1,
-                "line_description": rental_desc,
-                "unit_price": _clean_amount_string(data.get("rental_amount", 0)),
-                "gl_code": "535-000",
-            }
-            payload["security_deposit"] = _clean_amount_string(
-                data.get("security_deposit", 0)
-            )
-
-            total_amount += _clean_amount_string(data.get("rental_amount", 0))
-            total_amount += _clean_amount_string(data.get("security_deposit", 0))
-
-        start_date_val, end_date_val = data.get("rental_start_date"), data.get(
-            "rental_end_date"
-        )
-        start_date_str = (
-            start_date_val.strftime("%Y-%m-%d")
-            if isinstance(start_date_val, date)
-            else start_date_val
-        )
-        end_date_str = (
-            end_date_val.strftime("%Y-%m-%d")
-            if isinstance(end_date_val, date)
-            else end_date_val
-        )
-
-        payload.update(
-            {
-                "rental_period_type": data.get("rental_period_type", "monthly"),
-                "contract_period": data.get("contract_period"),
-                "rental_start_date": start_date_str,
-                "rental_end_date": end_date_str,
-                "rental_days": data.get("rental_days", "N/A"),
-                "selected_equipment": data.get("selected_equipment", []),
-            }
-        )
-
-    payload["total_amount"] = total_amount
-    payload["body"] = data.get("body", "")
-
-    logger.info(
-        "--- FINAL DISPATCHING PAYLOAD ---\n%s",
-        json.dumps(payload, indent=2, default=str),
-    )
+    dump_debug(logger, "--- FINAL DISPATCHING PAYLOAD ---", payload)
     context.bot_data["last_payload"] = payload
 
     await context.bot.send_message(
         chat_id=chat_id, text=f"Generating PDF for {doc_type}..."
     )
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(API_URL_LOCAL, json=payload, timeout=30)
+        client = get_http_client()
+        response = await client.post(API_URL_LOCAL, json=payload)
         response.raise_for_status()
         result = response.json()
         if result.get("success"):
@@ -764,242 +631,158 @@ async def dispatch_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
 async def check_and_transition(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    The central state machine that decides what information to ask for next.
+    Asks for whatever the quote is still missing, as decided by the step
+    table in bot/flow.py, or shows the final confirmation once complete.
     """
-    # --- Start Diagnosis Logging ---
-    logger.info("--- CHECK_AND_TRANSITION CALLED ---")
-    try:
-        user_data_json = json.dumps(context.user_data, indent=2, default=str)
-        logger.info("USER_DATA at start of check_and_transition:\n%s", user_data_json)
-    except Exception as e:
-        logger.error(f"Could not serialize user_data for logging: {e}")
-    # --- End Diagnosis Logging ---
+    data = context.user_data
+    step = flow.next_step(data)
+    if step is None:
+        logger.info("check_and_transition: all steps done, showing confirmation.")
+        await send_confirmation_message(update, context, is_review=False)
+        return
 
-    message = update.message or (
+    logger.info(f"check_and_transition: next step is '{step.name}'.")
+    if step.state is not None:
+        data["state"] = step.state
+    await _STEP_ACTIONS[step.action](update, context, step)
+
+
+# --- Step actions: how the bot asks for each pending step in bot/flow.py ---
+
+
+def _step_message(update: Update):
+    return update.message or (
         update.callback_query.message if update.callback_query else None
     )
-    data = context.user_data
-    doc_type = data.get("doc_type")
 
-    # Step 1: Ensure we have a document type
-    if not doc_type:
-        context.user_data["state"] = AWAITING_DOC_TYPE
-        await ask_for_doc_type(update, context)
-        return
 
-    # Step 6: Check if we've done the customer database check yet (Feature Disabled)
-    data["is_new_customer"] = True
-    data["customer_checked"] = True
-
-    # --- New: Contextual Company Name Handling (after doc_type is known) ---
-    if data.get("is_company_name_from_image_extracted") and data.get(
-        "extracted_image_company_name"
-    ):
-        extracted_name = data["extracted_image_company_name"]
-
-        if doc_type.startswith("refurbish"):
-            # Also applies to refurbish_proforma
-            # For refurbish, automatically use the name from the image
-            data["company_name"] = extracted_name
-            if "extracted_image_company_address" in data:
-                data["company_address"] = data["extracted_image_company_address"]
-
-            # Clean up temporary flags
-            data.pop("is_company_name_from_image_extracted", None)
-            data.pop("extracted_image_company_name", None)
-            data.pop(
-                "extracted_image_company_address", None
-            )  # If address was extracted from image
-            logger.info(
-                f"Refurbish quote: Auto-using company name from image: {extracted_name}"
-            )
-            # Recursively call check_and_transition to continue the flow
-            await check_and_transition(update, context)
-            return
+async def _ask_doc_type_step(update, context, step):
+    await ask_for_doc_type(update, context)
 
-        elif doc_type.startswith("sales") or doc_type.startswith(
-            "rental"
-        ):  # Applies to sales/rental and their proformas
-            # For sales/rental, ask for confirmation
-            context.user_data["state"] = AWAITING_COMPANY_NAME_CONFIRMATION
-            keyboard = [
-                [
-                    InlineKeyboardButton(
-                        f"Yes, use '{extracted_name}'",
-                        callback_data="confirm_company_name_yes",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "No, enter new name", callback_data="confirm_company_name_no"
-                    )
-                ],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.bot.send_message(
-                chat_id=message.chat_id,
-                text=f"I extracted a company name '{extracted_name}' from the image. Is this the customer's name for your {doc_type} quote?",
-                reply_markup=reply_markup,
+
+async def _confirm_company_name_step(update, context, step):
+    extracted_name = context.user_data["extracted_image_company_name"]
+    doc_type = context.user_data["doc_type"]
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                f"Yes, use '{extracted_name}'",
+                callback_data="confirm_company_name_yes",
             )
-            return
+        ],
+        [
+            InlineKeyboardButton(
+                "No, enter new name", callback_data="confirm_company_name_no"
+            )
+        ],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await context.bot.send_message(
+        chat_id=_step_message(update).chat_id,
+        text=f"I extracted a company name '{extracted_name}' from the image. Is this the customer's name for your {doc_type} quote?",
+        reply_markup=reply_markup,
+    )
 
-    # --- End: Contextual Company Name Handling ---
 
-    # Step 7: Now check for ALL required fields
-    required_fields = {
-        "company_name": "customer company name",
-        "company_address": "customer company address",
-        "cust_contact": "customer's phone number",
-        "salesperson": "salesperson's name",
-        "truck_number": "truck number (e.g., 'VAN 5222')",
-    }
-    if doc_type.startswith("sales") or doc_type.startswith(
-        "refurbish"
-    ):  # Also applies to sales_proforma/refurbish_proforma
-        required_fields.update({"body": "body type"})
-
-    # Check each required field
-    for field, prompt in required_fields.items():
-        field_value = data.get(field)
-        # A field is considered missing if it's None or an empty string.
-        # "0" or "N/A" are now considered provided (though hidden on PDF).
-        if not field_value and str(field_value).strip().upper() not in ["0", "N/A"]:
-            context.user_data["state"] = AWAITING_INFO
-            context.user_data["waiting_for_field"] = field
-            reply_markup = build_skip_keyboard()
-            await context.bot.send_message(
-                chat_id=message.chat_id,
-                text=missing_field_prompt(prompt),
-                reply_markup=reply_markup,
-            )
-            return
+async def _customer_lookup_step(update, context, step):
+    await check_customer_in_database(update, context)
 
-    # --- New Position for Issuing Company Check ---
-    # Ask for issuing company right after basic details, before doc-specific flows
-    issuing_company = data.get("issuing_company", "")
-    logger.info(
-        f"DEBUG: Checking issuing_company value: '{issuing_company}' (type: {type(issuing_company)})"
+
+async def _missing_field_step(update, context, step):
+    context.user_data["waiting_for_field"] = step.field
+    reply_markup = build_skip_keyboard()
+    await context.bot.send_message(
+        chat_id=_step_message(update).chat_id,
+        text=missing_field_prompt(step.prompt),
+        reply_markup=reply_markup,
     )
 
-    if (
-        not issuing_company
-        or str(issuing_company).strip() == ""
-        or str(issuing_company).strip().upper() == "N/A"
-    ):
-        logger.info(
-            "DEBUG: Issuing company is missing/N/A. Transitioning to WAITING_FOR_COMPANY."
-        )
-        context.user_data["state"] = WAITING_FOR_COMPANY
-        await ask_for_issuing_company(update, context)
-        return
-    else:
-        logger.info("DEBUG: Issuing company considered valid. Skipping selection.")
-
-    # All basic info collected! Now proceed to doc-specific flows
-    if doc_type.startswith("rental"):  # Also applies to rental_proforma
-        rental_period_type = data.get("rental_period_type")
-        if rental_period_type == "daily":
-            if not all(
-                key in data
-                for key in [
-                    "rental_start_date",
-                    "rental_end_date",
-                    "rental_amount",
-                    "security_deposit",
-                ]
-            ):
-                await start_rental_flow(update, context)
-                return
-        elif rental_period_type == "monthly":
-            if not all(
-                key in data
-                for key in ["contract_period", "rental_amount", "security_deposit"]
-            ):
-                await start_rental_flow(update, context)
-                return
-        else:  # If rental_period_type is not set at all
-            await start_rental_flow(update, context)
-            return
 
-        # If we get here, all details for either daily or monthly are collected
-        data["rental_details_collected"] = True
+async def _issuing_company_step(update, context, step):
+    await ask_for_issuing_company(update, context)
 
-        # Now, check for fee/equipment steps if they haven't been done
-        if not data.get("rental_fees_collected") or not data.get(
-            "rental_equipment_collected"
-        ):
-            # This will trigger the ask_for_next_rental_fee -> show_equipment_checklist chain
-            await ask_for_next_rental_fee(update, context)
-            return
 
-    elif doc_type.startswith("sales"):  # Also applies to sales_proforma
-        if not data.get("lorry_sale_item_created"):
-            if data.get("line_items"):
-                price = data["line_items"][0].get("unit_price", "N/A")
-                message_text = f"I see the lorry price is RM {price}. Please clarify the description:"
-                context.user_data["state"] = SELECTING_LORRY_SALE_TYPE
-                keyboard = [
-                    [
-                        InlineKeyboardButton(
-                            "Lorry Price OTR",
-                            callback_data="clarify_sale_type_Lorry Price OTR",
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            "Lorry Harga SHJ",
-                            callback_data="clarify_sale_type_Lorry Harga SHJ",
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            "Offroad", callback_data="clarify_sale_type_Offroad"
-                        )
-                    ],
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await message.reply_text(message_text, reply_markup=reply_markup)
-            else:
-                context.user_data["state"] = SELECTING_LORRY_SALE_TYPE
-                await ask_for_lorry_sale_type(update, context)
-            return
+async def _rental_details_step(update, context, step):
+    await start_rental_flow(update, context)
 
-        if not data.get("main_services_done"):
-            context.user_data["state"] = SELECTING_MAIN_SERVICE
-            await show_main_services(update, context)
-            return
 
-        if not data.get("additional_services_done"):
-            context.user_data["state"] = SELECTING_ADDITIONAL_SERVICES
-            await show_additional_services(update, context)
-            return
+async def _rental_fees_step(update, context, step):
+    # This will trigger the ask_for_next_rental_fee -> show_equipment_checklist chain
+    await ask_for_next_rental_fee(update, context)
 
-        if not data.get("payment_phases_complete"):
-            context.user_data["state"] = ASK_FOR_PAYMENT_PHASES
-            keyboard = [
-                [InlineKeyboardButton("Yes", callback_data="payment_phase_yes")],
-                [InlineKeyboardButton("No", callback_data="payment_phase_no")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.bot.send_message(
-                chat_id=message.chat_id,
-                text="Do you want to add a phased payment schedule?",
-                reply_markup=reply_markup,
-            )
-            return
 
-    elif doc_type.startswith("refurbish"):  # Also applies to refurbish_proforma
-        if not data.get("line_items"):
-            context.user_data["state"] = AWAITING_INFO
-            context.user_data["waiting_for_field"] = "line_items"
-            await context.bot.send_message(
-                chat_id=message.chat_id,
-                text="I need the line items for the refurbish quote (e.g., '1 unit rm10000' or 'description - RM price'). Please provide them.",
+async def _lorry_sale_type_step(update, context, step):
+    data = context.user_data
+    if not data.get("line_items"):
+        await ask_for_lorry_sale_type(update, context)
+        return
+
+    price = data["line_items"][0].get("unit_price", "N/A")
+    message_text = (
+        f"I see the lorry price is RM {price}. Please clarify the description:"
+    )
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                "Lorry Price OTR",
+                callback_data="clarify_sale_type_Lorry Price OTR",
             )
-            return
+        ],
+        [
+            InlineKeyboardButton(
+                "Lorry Harga SHJ",
+                callback_data="clarify_sale_type_Lorry Harga SHJ",
+            )
+        ],
+        [InlineKeyboardButton("Offroad", callback_data="clarify_sale_type_Offroad")],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await _step_message(update).reply_text(message_text, reply_markup=reply_markup)
+
+
+async def _main_services_step(update, context, step):
+    await show_main_services(update, context)
 
-    # Everything collected! Show final confirmation
-    await send_confirmation_message(update, context, is_review=False)
+
+async def _additional_services_step(update, context, step):
+    await show_additional_services(update, context)
+
+
+async def _payment_phases_step(update, context, step):
+    keyboard = [
+        [InlineKeyboardButton("Yes", callback_data="payment_phase_yes")],
+        [InlineKeyboardButton("No", callback_data="payment_phase_no")],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await context.bot.send_message(
+        chat_id=_step_message(update).chat_id,
+        text="Do you want to add a phased payment schedule?",
+        reply_markup=reply_markup,
+    )
+
+
+async def _refurbish_line_items_step(update, context, step):
+    context.user_data["waiting_for_field"] = step.field
+    await context.bot.send_message(
+        chat_id=_step_message(update).chat_id,
+        text="I need the line items for the refurbish quote (e.g., '1 unit rm10000' or 'description - RM price'). Please provide them.",
+    )
+
+
+_STEP_ACTIONS = {
+    "doc_type": _ask_doc_type_step,
+    "confirm_company_name": _confirm_company_name_step,
+    "customer_lookup": _customer_lookup_step,
+    "missing_field": _missing_field_step,
+    "issuing_company": _issuing_company_step,
+    "rental_details": _rental_details_step,
+    "rental_fees": _rental_fees_step,
+    "lorry_sale_type": _lorry_sale_type_step,
+    "main_services": _main_services_step,
+    "additional_services": _additional_services_step,
+    "payment_phases": _payment_phases_step,
+    "refurbish_line_items": _refurbish_line_items_step,
+}
 
 
 async def show_equipment_checklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -0,0 +1,60 @@
+# bot/metrics.py
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Process-wide counters and timings. They live in memory only and are
+# reported by the /stats command.
+_counters = defaultdict(int)
+_timings = {}  # name -> [count, total_seconds, max_seconds]
+
+
+def incr(name: str, amount: int = 1) -> None:
+    """Increments a named counter."""
+    _counters[name] += amount
+
+
+def observe(name: str, seconds: float) -> None:
+    """Records one duration sample for a named timing."""
+    timing = _timings.setdefault(name, [0, 0.0, 0.0])
+    timing[0] += 1
+    timing[1] += seconds
+    timing[2] = max(timing[2], seconds)
+
+
+@contextmanager
+def timed(name: str):
+    """Records how long the wrapped block took under a named timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def snapshot() -> dict:
+    """Returns a copy of all counters and timing summaries."""
+    return {
+        "counters": dict(_counters),
+        "timings": {
+            name: {
+                "count": count,
+                "avg_ms": round(total / count * 1000, 1) if count else 0.0,
+                "max_ms": round(peak * 1000, 1),
+            }
+            for name, (count, total, peak) in _timings.items()
+        },
+    }
+
+
+def format_snapshot() -> str:
+    """Formats the current metrics as a plain-text report."""
+    data = snapshot()
+    lines = ["--- Counters ---"]
+    lines += [f"{name}: {value}" for name, value in sorted(data["counters"].items())]
+    lines.append("--- Timings ---")
+    lines += [
+        f"{name}: n={t['count']} avg={t['avg_ms']}ms max={t['max_ms']}ms"
+        for name, t in sorted(data["timings"].items())
+    ]
+    return "\n".join(lines)
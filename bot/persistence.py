@@ -0,0 +1,305 @@
+# bot/persistence.py
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often the Application hands changed data to the persistence (seconds).
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "10"))
+# Handed-over rows are written in one batch every PERSISTENCE_FLUSH_INTERVAL
+# seconds, or as soon as PERSISTENCE_FLUSH_THRESHOLD rows are waiting.
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "30"))
+PERSISTENCE_FLUSH_THRESHOLD = int(os.getenv("PERSISTENCE_FLUSH_THRESHOLD", "50"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS chat_data (
+    chat_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS kv_data (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+_ID_COLUMNS = {"user_data": "user_id", "chat_data": "chat_id", "kv_data": "key"}
+
+# Marks a row that is waiting to be deleted.
+_DELETED = object()
+_MISSING = object()
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Stores each user's and chat's data as its own pickled row in SQLite (WAL mode).
+
+    Unlike PicklePersistence, nothing is loaded up front: a user's row is read
+    the first time one of their updates is handled (refresh_user_data), and
+    only rows whose contents actually changed are written back.
+
+    Writes are deferred: data handed over by the Application is kept as dirty
+    rows, coalesced per user/chat, and written in a single transaction on a
+    worker thread every flush_interval seconds or once flush_threshold rows
+    are waiting. flush() writes everything left and checkpoints the WAL.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        store_data: PersistenceInput = None,
+        update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+        flush_interval: float = PERSISTENCE_FLUSH_INTERVAL,
+        flush_threshold: int = PERSISTENCE_FLUSH_THRESHOLD,
+        legacy_pickle_path: str = None,
+    ):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+
+        # The writer connection is only used by one flush at a time, from a
+        # worker thread; reads happen on the event loop through their own
+        # connection, which WAL mode lets run alongside a write.
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._read_conn = sqlite3.connect(filepath)
+
+        self._loaded_user_ids = set()
+        self._loaded_chat_ids = set()
+        # Digest of the last written blob per row, to skip unchanged writes.
+        self._digests = {}
+        # Rows waiting to be written, and the batch currently being written.
+        self._dirty = {}
+        self._flushing = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._flush_task = None
+        self._closing = False
+
+        if legacy_pickle_path and os.path.exists(legacy_pickle_path):
+            self._import_legacy_pickle(legacy_pickle_path)
+
+    # --- Helpers ---
+
+    def _read(self, table: str, row_id, default=None):
+        """Reads a row, preferring data that has not been written yet."""
+        key = (table, row_id)
+        pending = self._dirty.get(key, self._flushing.get(key, _MISSING))
+        if pending is _DELETED:
+            return default
+        if pending is not _MISSING:
+            return pending
+
+        row = self._read_conn.execute(
+            f"SELECT data FROM {table} WHERE {_ID_COLUMNS[table]} = ?", (row_id,)
+        ).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def _mark_dirty(self, table: str, row_id, data) -> None:
+        self._dirty[(table, row_id)] = data
+        if self._closing:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._flush_loop()
+            )
+        if len(self._dirty) >= self.flush_threshold:
+            self._flush_requested.set()
+
+    def _serialize(self, batch: dict) -> tuple[list, dict]:
+        """Pickles a batch, dropping rows identical to what was last written."""
+        rows, digests = [], {}
+        for key, data in batch.items():
+            if data is _DELETED:
+                rows.append((*key, None))
+                digests[key] = None
+                continue
+            blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+            digest = hashlib.blake2b(blob, digest_size=16).digest()
+            if self._digests.get(key) != digest:
+                rows.append((*key, blob))
+                digests[key] = digest
+        return rows, digests
+
+    def _write_rows(self, rows: list) -> None:
+        """Writes (table, row_id, blob) rows in one transaction; a None blob deletes."""
+        with self._conn:
+            for table, row_id, blob in rows:
+                id_column = _ID_COLUMNS[table]
+                if blob is None:
+                    self._conn.execute(
+                        f"DELETE FROM {table} WHERE {id_column} = ?", (row_id,)
+                    )
+                else:
+                    self._conn.execute(
+                        f"INSERT INTO {table} ({id_column}, data) VALUES (?, ?) "
+                        f"ON CONFLICT({id_column}) DO UPDATE SET data = excluded.data, "
+                        "updated_at = CURRENT_TIMESTAMP",
+                        (row_id, blob),
+                    )
+
+    def _remember_digests(self, digests: dict) -> None:
+        for key, digest in digests.items():
+            if digest is None:
+                self._digests.pop(key, None)
+            else:
+                self._digests[key] = digest
+
+    async def _flush_dirty(self) -> None:
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            started = time.perf_counter()
+            try:
+                rows, digests = self._serialize(self._flushing)
+                if rows:
+                    await asyncio.to_thread(self._write_rows, rows)
+            except Exception:
+                logger.exception("Persistence flush failed, keeping rows for retry.")
+                for key, data in self._flushing.items():
+                    self._dirty.setdefault(key, data)
+                return
+            finally:
+                batch_size = len(self._flushing)
+                self._flushing = {}
+
+            self._remember_digests(digests)
+            elapsed = time.perf_counter() - started
+            metrics.observe("persistence.flush", elapsed)
+            metrics.incr("persistence.flushes")
+            metrics.incr("persistence.rows_written", len(rows))
+            metrics.incr("persistence.rows_unchanged", batch_size - len(rows))
+            logger.info(
+                f"Persistence flush: {len(rows)} of {batch_size} dirty row(s) "
+                f"written in {elapsed * 1000:.1f} ms."
+            )
+
+    async def _flush_loop(self) -> None:
+        while not self._closing:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), timeout=self.flush_interval
+                )
+            self._flush_requested.clear()
+            await self._flush_dirty()
+
+    def _import_legacy_pickle(self, path: str) -> None:
+        """One-time import of a PicklePersistence file into an empty database."""
+        has_rows = self._conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM user_data) OR EXISTS (SELECT 1 FROM chat_data)"
+        ).fetchone()[0]
+        if has_rows:
+            return
+
+        with open(path, "rb") as f:
+            legacy = pickle.load(f)
+        batch = {}
+        for user_id, data in (legacy.get("user_data") or {}).items():
+            batch[("user_data", user_id)] = data
+        for chat_id, data in (legacy.get("chat_data") or {}).items():
+            batch[("chat_data", chat_id)] = data
+        if legacy.get("bot_data"):
+            batch[("kv_data", "bot_data")] = legacy["bot_data"]
+        rows, digests = self._serialize(batch)
+        self._write_rows(rows)
+        self._remember_digests(digests)
+        logger.info(
+            f"Imported {len(legacy.get('user_data') or {})} user(s) and "
+            f"{len(legacy.get('chat_data') or {})} chat(s) from {path}."
+        )
+
+    # --- Loading: users and chats are loaded lazily in refresh_*_data ---
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return self._read("kv_data", "bot_data", {})
+
+    async def get_callback_data(self):
+        return self._read("kv_data", "callback_data")
+
+    async def get_conversations(self, name: str) -> dict:
+        return self._read("kv_data", f"conversations:{name}", {})
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._loaded_user_ids:
+            return
+        self._loaded_user_ids.add(user_id)
+        user_data.update(self._read("user_data", user_id, {}))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        if chat_id in self._loaded_chat_ids:
+            return
+        self._loaded_chat_ids.add(chat_id)
+        chat_data.update(self._read("chat_data", chat_id, {}))
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # --- Saving: rows are only marked dirty here and written by _flush_dirty ---
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._mark_dirty("user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._mark_dirty("chat_data", chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._mark_dirty("kv_data", "bot_data", data)
+
+    async def update_callback_data(self, data) -> None:
+        self._mark_dirty("kv_data", "callback_data", data)
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        conversations = dict(self._read("kv_data", f"conversations:{name}", {}))
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self._mark_dirty("kv_data", f"conversations:{name}", conversations)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark_dirty("user_data", user_id, _DELETED)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark_dirty("chat_data", chat_id, _DELETED)
+
+    async def flush(self) -> None:
+        """Writes all pending rows and checkpoints the WAL before shutdown."""
+        # Let the loop finish a write in progress rather than cancelling it,
+        # which would drop the batch while the worker thread still uses the
+        # connection.
+        self._closing = True
+        if self._flush_task is not None:
+            self._flush_requested.set()
+            await self._flush_task
+            self._flush_task = None
+        await self._flush_dirty()
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._read_conn.close()
+        self._conn.close()
@@ -0,0 +1,94 @@
+# bot/prefetch.py
+"""
+Per-chat registry of lookups started ahead of time.
+
+As soon as an input is known (e.g. the customer's company name right after
+extraction) the lookup is started as a background task and registered here
+under the chat, a kind and a key. The step that needs the result later
+calls `consume`, which awaits the running (usually finished) task instead
+of starting the lookup from scratch. Tasks cannot be pickled, so they live
+here rather than in user_data.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Results of tasks started longer ago than this (seconds) are not used.
+PREFETCH_MAX_AGE = float(os.getenv("PREFETCH_MAX_AGE", "600"))
+
+# chat_id -> {(kind, key): (started_at, task)}
+_tasks = {}
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"{task.get_name()} failed: {task.exception()}")
+
+
+def _prune(now: float) -> None:
+    """Drops lookups too old to be used, e.g. of chats that left the flow."""
+    for chat_id in list(_tasks):
+        chat_tasks = _tasks[chat_id]
+        for entry in [
+            entry
+            for entry, (started_at, _) in chat_tasks.items()
+            if now - started_at > PREFETCH_MAX_AGE
+        ]:
+            chat_tasks.pop(entry)[1].cancel()
+        if not chat_tasks:
+            del _tasks[chat_id]
+
+
+def prefetch(chat_id: int, kind: str, key: str, func, *args) -> None:
+    """
+    Starts func(*args) in the background for a chat unless the same lookup
+    is already running. Earlier lookups of the same kind, and lookups of
+    any chat older than PREFETCH_MAX_AGE, are dropped.
+    """
+    now = time.monotonic()
+    _prune(now)
+    chat_tasks = _tasks.setdefault(chat_id, {})
+    if (kind, key) in chat_tasks:
+        return
+    for stale in [entry for entry in chat_tasks if entry[0] == kind]:
+        chat_tasks.pop(stale)[1].cancel()
+
+    task = asyncio.create_task(func(*args), name=f"prefetch {kind} for chat {chat_id}")
+    task.add_done_callback(_log_failure)
+    chat_tasks[(kind, key)] = (now, task)
+    metrics.incr(f"prefetch.{kind}.started")
+
+
+async def consume(chat_id: int, kind: str, key: str, func, *args):
+    """
+    Returns the prefetched result for (kind, key), waiting for it if it is
+    still running, or calls func(*args) if nothing usable was prefetched.
+    """
+    chat_tasks = _tasks.get(chat_id, {})
+    entry = chat_tasks.pop((kind, key), None)
+    if not chat_tasks:
+        _tasks.pop(chat_id, None)
+    if entry is not None:
+        started_at, task = entry
+        fresh = time.monotonic() - started_at <= PREFETCH_MAX_AGE
+        if fresh and not task.cancelled():
+            metrics.incr(f"prefetch.{kind}.{'ready' if task.done() else 'waited'}")
+            try:
+                return await task
+            except Exception as e:
+                logger.warning(f"Prefetched {kind} lookup failed, retrying: {e}")
+        else:
+            task.cancel()
+    metrics.incr(f"prefetch.{kind}.missed")
+    return await func(*args)
+
+
+def discard(chat_id: int) -> None:
+    """Cancels and forgets everything prefetched for a chat."""
+    for _, task in _tasks.pop(chat_id, {}).values():
+        task.cancel()
@@ -0,0 +1,125 @@
+# bot/retry.py
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Attempts per call, including the first one.
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+# Backoff before retry n is a random delay up to min(max, base * 2**n) seconds
+# ("full jitter"), so callers that failed together do not retry together.
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+# Retry budget: every call earns RETRY_BUDGET_RATIO of a retry and the budget
+# refills by RETRY_BUDGET_MIN_PER_SECOND on its own, up to RETRY_BUDGET_MAX.
+# During an outage retries are capped at roughly that fraction of traffic
+# instead of multiplying it.
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "0.1"))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "10"))
+
+# Errors worth another attempt: rate limits, server-side failures, timeouts,
+# dropped connections and malformed model output. Anything else (bad
+# requests, auth errors, blocked prompts) fails the same way every time.
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError,
+    json.JSONDecodeError,
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class RetryBudget:
+    """Token bucket shared by all callers that limits retries across the process."""
+
+    def __init__(
+        self,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+        max_tokens: float = RETRY_BUDGET_MAX,
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = time.monotonic()
+        earned = (now - self._updated_at) * self.min_per_second + amount
+        self._tokens = min(self.max_tokens, self._tokens + earned)
+        self._updated_at = now
+
+    def record_call(self) -> None:
+        """Credits the budget for a first attempt."""
+        self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Takes one retry from the budget; returns False if it is used up."""
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+retry_budget = RetryBudget()
+
+
+def backoff_delay(retry: int) -> float:
+    """Returns the full-jitter delay before the given retry (0 for the first)."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**retry))
+
+
+async def call_with_retry(
+    name: str,
+    func,
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    budget: RetryBudget = retry_budget,
+):
+    """
+    Awaits func() until it succeeds, backing off between attempts. Gives up
+    and re-raises on a non-retryable error, after max_attempts, or when the
+    retry budget is exhausted. Latencies and retry counts are recorded under
+    `name` in metrics.
+    """
+    budget.record_call()
+    with metrics.timed(name):
+        for attempt in range(max_attempts):
+            started = time.perf_counter()
+            try:
+                return await func()
+            except Exception as e:
+                metrics.observe(f"{name}.failed_attempt", time.perf_counter() - started)
+                if not is_retryable(e):
+                    metrics.incr(f"{name}.errors.non_retryable")
+                    raise
+                if attempt + 1 >= max_attempts:
+                    metrics.incr(f"{name}.errors.attempts_exhausted")
+                    raise
+                if not budget.try_spend():
+                    metrics.incr(f"{name}.errors.budget_exhausted")
+                    logger.warning(f"{name}: retry budget exhausted, not retrying: {e}")
+                    raise
+
+                delay = backoff_delay(attempt)
+                metrics.incr(f"{name}.retries")
+                logger.warning(
+                    f"{name}: attempt {attempt + 1} failed ({e}), "
+                    f"retrying in {delay:.1f}s."
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,82 @@
+# bot/router.py
+import logging
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Key under which a trie node stores the route that ends at it.
+_ROUTE = None
+
+
+class CallbackRouter:
+    """
+    Maps callback data to handlers. Handlers register exact values or
+    prefixes; a callback goes to its exact match if there is one, otherwise
+    to the longest registered prefix, found in one walk of a prefix trie.
+    Registering the same value or prefix twice raises ValueError, so
+    conflicting routes fail at import time instead of depending on order.
+    """
+
+    def __init__(self, name: str = "callbacks"):
+        self.name = name
+        self._exact = {}
+        self._trie = {}
+
+    def route(self, *prefixes: str, exact: str = None):
+        """Decorator registering a handler for callback data prefixes and/or one exact value."""
+
+        def decorator(handler):
+            if exact is not None:
+                self._add_exact(exact, handler)
+            for prefix in prefixes:
+                self._add_prefix(prefix, handler)
+            return handler
+
+        return decorator
+
+    def _add_exact(self, value: str, handler) -> None:
+        if value in self._exact:
+            raise ValueError(
+                f"Callback '{value}' is already routed to "
+                f"{self._exact[value][1].__name__}, cannot add {handler.__name__}."
+            )
+        self._exact[value] = (value, handler)
+
+    def _add_prefix(self, prefix: str, handler) -> None:
+        if not prefix:
+            raise ValueError("Callback prefixes must not be empty.")
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if _ROUTE in node:
+            raise ValueError(
+                f"Callback prefix '{prefix}' is already routed to "
+                f"{node[_ROUTE][1].__name__}, cannot add {handler.__name__}."
+            )
+        node[_ROUTE] = (prefix, handler)
+
+    def resolve(self, data: str):
+        """Returns (route, handler) for callback data, or (None, None) if nothing matches."""
+        match = self._exact.get(data)
+        if match is not None:
+            return match
+
+        match = (None, None)
+        node = self._trie
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            match = node.get(_ROUTE, match)
+        return match
+
+    async def dispatch(self, update, context) -> bool:
+        """Runs the handler for update.callback_query; returns False if none matched."""
+        route, handler = self.resolve(update.callback_query.data)
+        if handler is None:
+            metrics.incr(f"{self.name}.unhandled")
+            return False
+        metrics.incr(f"{self.name}.{route}")
+        await handler(update, context)
+        return True
@@ -0,0 +1,79 @@
+# bot/state_history.py
+import os
+from array import array
+
+# How many previous states "back" navigation can step through.
+STATE_HISTORY_SIZE = int(os.getenv("STATE_HISTORY_SIZE", "20"))
+
+# Conversation states are small ints; 255 stands in for "no state yet".
+_NO_STATE = 255
+
+
+class StateHistory:
+    """
+    Fixed-capacity history of conversation states, stored as one byte per
+    state in a ring buffer. Once full, pushing a state overwrites the oldest
+    one, so its memory and pickled size stay constant for a chat.
+    """
+
+    __slots__ = ("_buffer", "_start", "_size")
+
+    def __init__(self, states=(), capacity: int = STATE_HISTORY_SIZE):
+        self._buffer = array("B", bytes(capacity))
+        self._start = 0
+        self._size = 0
+        for state in states:
+            self.append(state)
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    def append(self, state) -> None:
+        """Adds a state, dropping the oldest one if the history is full."""
+        value = _NO_STATE if state is None else state
+        if self._size == self.capacity:
+            self._buffer[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+        else:
+            self._buffer[(self._start + self._size) % self.capacity] = value
+            self._size += 1
+
+    def push(self, state) -> None:
+        """Adds a state unless it is already the most recent one."""
+        if not self._size or self[-1] != state:
+            self.append(state)
+
+    def pop(self):
+        """Removes and returns the most recent state."""
+        if not self._size:
+            raise IndexError("pop from empty StateHistory")
+        self._size -= 1
+        value = self._buffer[(self._start + self._size) % self.capacity]
+        return None if value == _NO_STATE else value
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("StateHistory index out of range")
+        value = self._buffer[(self._start + index) % self.capacity]
+        return None if value == _NO_STATE else value
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        return (self[i] for i in range(self._size))
+
+    def __repr__(self) -> str:
+        return f"StateHistory({list(self)!r}, capacity={self.capacity})"
+
+
+def get_state_history(user_data: dict) -> StateHistory:
+    """Returns the chat's StateHistory, converting a legacy list if needed."""
+    history = user_data.get("state_history")
+    if not isinstance(history, StateHistory):
+        history = StateHistory(history or [])
+        user_data["state_history"] = history
+    return history
@@ -113,6 +113,8 @@ def build_confirmation_text(data, is_review=False) -> str:
 
     else:  # Sales and Refurbish
         confirmation_text += f"Body: {get_display_value(data.get('body'))}\n\n"
+        if data.get("lorry_price"):
+            confirmation_text += f"Lorry Price: {get_display_value(data.get('lorry_price'), is_price=True)}\n\n"
 
         if data.get("line_items"):
             confirmation_text += "Line Items:\n"
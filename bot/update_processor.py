@@ -0,0 +1,92 @@
+# bot/update_processor.py
+import asyncio
+import logging
+import os
+import sys
+import weakref
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from log_utils import current_chat_id
+
+from .limiter import on_queued
+
+logger = logging.getLogger(__name__)
+
+# How many updates may be handled at the same time across all chats.
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+
+def _queued_notifier(message):
+    """Returns an on_queued callback that tells the chat once per update."""
+    notified = False
+
+    async def notify(ahead: int) -> None:
+        nonlocal notified
+        if notified:
+            return
+        notified = True
+        await message.reply_text(
+            f"⏳ It's busy right now, your request is queued ({ahead} ahead of it)."
+            " I'll continue shortly."
+        )
+
+    return notify
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Handles updates from different chats concurrently, while updates from the
+    same chat run one after another in arrival order. This keeps a slow
+    handler in one chat (e.g. a Gemini call) from delaying everyone else,
+    without two handlers ever changing the same chat's user_data at once.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        # The base class takes its semaphore before do_process_update, so an
+        # update waiting for its chat's lock would hold a slot and a busy
+        # chat could starve the others. Its limit is effectively disabled
+        # here and ours is only taken once the chat's turn has come.
+        super().__init__(sys.maxsize)
+        self._update_slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # Locks disappear on their own once no update of that chat is pending.
+        self._chat_locks = weakref.WeakValueDictionary()
+
+    def _lock_for(self, update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            key = update.effective_chat.id
+        elif update.effective_user:
+            key = f"user_{update.effective_user.id}"
+        else:
+            return None
+
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._chat_locks[key] = lock
+        return lock
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        # Each update runs in its own task, so this only tags this update's logs.
+        if isinstance(update, Update) and update.effective_chat:
+            current_chat_id.set(update.effective_chat.id)
+        if isinstance(update, Update) and update.effective_message:
+            on_queued.set(_queued_notifier(update.effective_message))
+
+        lock = self._lock_for(update)
+        if lock is None:
+            async with self._update_slots:
+                await coroutine
+            return
+        # asyncio.Lock wakes waiters first-in, first-out, which keeps per-chat order.
+        async with lock, self._update_slots:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,277 @@
+# log_utils.py
+import atexit
+import contextlib
+import contextvars
+import copy
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+from datetime import datetime, timedelta
+
+DEFAULT_LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# The bot's records also carry the chat they were logged for, so /reprintlog
+# can filter by chat.
+BOT_LOG_FORMAT = (
+    "%(asctime)s - chat %(chat_id)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# The bot's own log file, also served by the /reprintlog command.
+BOT_LOG_FILE = os.getenv("BOT_LOG_FILE", "bot output.txt")
+
+# Chat whose update is being handled in the current task ("-" outside updates).
+current_chat_id = contextvars.ContextVar("current_chat_id", default="-")
+
+# Log files rotate by size, or by time if LOG_ROTATE_WHEN is set
+# (a TimedRotatingFileHandler interval such as "midnight" or "H").
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+
+# Level at which full user_data/payload dumps are logged. They are skipped
+# entirely (no serialization) unless the logger is enabled for this level.
+LOG_DUMP_LEVEL = logging.getLevelName(os.getenv("LOG_DUMP_LEVEL", "DEBUG").upper())
+# Fraction of dumps that are actually logged, e.g. 0.1 for one in ten.
+LOG_DUMP_SAMPLE_RATE = float(os.getenv("LOG_DUMP_SAMPLE_RATE", "1.0"))
+# Dumps longer than this many characters are cut off.
+LOG_DUMP_MAX_CHARS = int(os.getenv("LOG_DUMP_MAX_CHARS", "4000"))
+
+
+class LazyDump:
+    """
+    Wraps an object so it is only turned into indented JSON when the log
+    record is formatted, and cut to max_chars characters.
+    """
+
+    __slots__ = ("obj", "max_chars")
+
+    def __init__(self, obj, max_chars: int = LOG_DUMP_MAX_CHARS):
+        self.obj = obj
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        try:
+            text = json.dumps(self.obj, indent=2, default=str)
+        except Exception as e:
+            text = f"<unserializable {type(self.obj).__name__}: {e}>"
+        if self.max_chars and len(text) > self.max_chars:
+            omitted = len(text) - self.max_chars
+            text = f"{text[: self.max_chars]}\n... ({omitted} more characters)"
+        return text
+
+
+def dump_debug(
+    logger: logging.Logger,
+    title: str,
+    obj,
+    level: int = None,
+    sample_rate: float = None,
+) -> None:
+    """
+    Logs `title` followed by a snapshot of `obj` as JSON, but only if the
+    logger is enabled for the dump level and the call is picked by sampling.
+    """
+    level = LOG_DUMP_LEVEL if level is None else level
+    if not logger.isEnabledFor(level):
+        return
+    sample_rate = LOG_DUMP_SAMPLE_RATE if sample_rate is None else sample_rate
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    # The record is formatted later on the listener thread; copy obj now so
+    # the log shows it as it is at this call, not after later changes.
+    try:
+        dump = LazyDump(copy.deepcopy(obj))
+    except Exception:
+        dump = str(LazyDump(obj))
+    logger.log(level, "%s\n%s", title, dump)
+
+
+# --- Queue-based logging ---
+# Loggers only put records on an in-memory queue; a listener thread per queue
+# writes them to the console and files, so code on the event loop never waits
+# on disk I/O.
+
+_listeners = []
+
+
+class ChatIdFilter(logging.Filter):
+    """Stamps each record with the chat id from current_chat_id."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.chat_id = current_chat_id.get()
+        return True
+
+
+def rotating_file_handler(path: str) -> logging.Handler:
+    """Returns a size- or time-rotating file handler for path."""
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records unformatted, so the listener's handlers format them on
+    its thread. The stock prepare() formats on the logging thread, which
+    would still render LazyDump arguments on the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # Only the argument container is copied; objects inside it are
+        # rendered as they are when the listener gets to them.
+        if isinstance(record.args, dict):
+            record.args = dict(record.args)
+        elif record.args:
+            record.args = tuple(record.args)
+        return record
+
+
+def queue_handler(*handlers: logging.Handler) -> logging.Handler:
+    """
+    Returns a QueueHandler whose records are written to `handlers` by a
+    background listener thread. Listeners are stopped, and their queues
+    drained, at interpreter exit.
+    """
+    record_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        record_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    if not _listeners:
+        atexit.register(stop_queue_logging)
+    _listeners.append(listener)
+    return _RecordQueueHandler(record_queue)
+
+
+def setup_queue_logging(
+    log_file: str = None, level: int = logging.INFO, fmt: str = DEFAULT_LOG_FORMAT
+) -> None:
+    """
+    Routes the root logger through a queue to the console and, if given, a
+    rotating log file. Replaces any handlers already on the root logger.
+    """
+    formatter = logging.Formatter(fmt)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(rotating_file_handler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root_handler = queue_handler(*handlers)
+    root_handler.addFilter(ChatIdFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(root_handler)
+    root.setLevel(level)
+
+
+def stop_queue_logging() -> None:
+    """Writes out all queued records and stops the listener threads."""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+# --- Reading logs back ---
+
+# Every record starts with its asctime; other lines continue the record above.
+_RECORD_START_REGEX = re.compile(rb"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d{3} ")
+_DURATION_REGEX = re.compile(r"^(\d+)([smhd])$")
+_DURATION_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+
+def parse_duration(text: str) -> timedelta:
+    """Parses durations like '30m', '2h' or '1d'; raises ValueError otherwise."""
+    match = _DURATION_REGEX.match(text.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid duration '{text}', expected e.g. 30m, 2h or 1d.")
+    amount, unit = match.groups()
+    return timedelta(**{_DURATION_UNITS[unit]: int(amount)})
+
+
+def _reversed_lines(f, chunk_size: int = 64 * 1024):
+    """Yields the lines of a binary file from last to first, one chunk at a time."""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = b""
+    while position > 0:
+        read_size = min(chunk_size, position)
+        position -= read_size
+        f.seek(position)
+        lines = (f.read(read_size) + remainder).split(b"\n")
+        remainder = lines.pop(0)
+        yield from reversed(lines)
+    yield remainder
+
+
+# Suffixes of rotated log files: "1", "2", ... for size rotation, dates such
+# as "2024-05-01" or "2024-05-01_13" for time rotation.
+_ROTATED_SUFFIX_REGEX = re.compile(r"^(?:(\d+)|(\d{4}-\d{2}-\d{2}[\d_-]*))$")
+
+
+def _log_files_newest_first(path: str) -> list[str]:
+    """Returns path followed by its rotated files, newest first."""
+    numbered, dated = [], []
+    for rotated in glob.glob(glob.escape(path) + ".*"):
+        match = _ROTATED_SUFFIX_REGEX.match(rotated[len(path) + 1 :])
+        if match and match.group(1):
+            numbered.append((int(match.group(1)), rotated))
+        elif match:
+            dated.append(rotated)
+    numbered = [rotated for _, rotated in sorted(numbered)]
+    return [path, *numbered, *sorted(dated, reverse=True)]
+
+
+def _reversed_log_lines(path: str):
+    """Yields the lines of a log file and then its rotated files, last to first."""
+    for log_path in _log_files_newest_first(path):
+        with open(log_path, "rb") as f:
+            yield from _reversed_lines(f)
+
+
+def tail_log_records(
+    path: str, limit: int = None, since: datetime = None, contains=()
+) -> list[str]:
+    """
+    Returns the last `limit` records of a log file that were logged after
+    `since` and contain every string in `contains`, oldest first. The file,
+    and then its rotated files, are read backwards and reading stops as
+    soon as the result is complete.
+    """
+    records = []
+    continuation = []
+    with contextlib.closing(_reversed_log_lines(path)) as lines:
+        for line in lines:
+            match = _RECORD_START_REGEX.match(line)
+            if not match:
+                if line:
+                    continuation.append(line)
+                continue
+
+            record_lines = [line, *reversed(continuation)]
+            continuation = []
+            if since is not None:
+                logged_at = datetime.strptime(
+                    match.group(1).decode(), "%Y-%m-%d %H:%M:%S"
+                )
+                if logged_at < since:
+                    break
+
+            record = b"\n".join(record_lines).decode("utf-8", errors="replace")
+            if all(text in record for text in contains):
+                records.append(record)
+                if limit and len(records) >= limit:
+                    break
+
+    records.reverse()
+    return records
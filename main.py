@@ -13,7 +13,6 @@ from telegram.ext import (
 )
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -21,39 +20,71 @@ from telegram.ext import (
     MessageHandler,
     filters,
     CallbackQueryHandler,
-    PicklePersistence,
 )
 
-from config import GEMINI_API_KEY, TELEGRAM_BOT_TOKEN
+from config import TELEGRAM_BOT_TOKEN
 from bot.handlers import (
     start_command,
     handle_text,
     handle_photo,
     master_callback_handler,
     reprint_log_command,
+    stats_command,
 )
+from bot.ai_backend import get_backend
+from bot.http_client import close_http_client
+from bot.persistence import SQLitePersistence
+from bot.update_processor import ChatOrderedUpdateProcessor, MAX_CONCURRENT_UPDATES
+from log_utils import BOT_LOG_FILE, BOT_LOG_FORMAT, setup_queue_logging
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+setup_queue_logging(BOT_LOG_FILE, fmt=BOT_LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-genai.configure(api_key=GEMINI_API_KEY)
+PERSISTENCE_DB_PATH = os.getenv("PERSISTENCE_DB_PATH", "persistence.sqlite3")
+
+# "polling" (default) or "webhook". Webhook mode runs a built-in HTTP listener
+# that Telegram, usually through a reverse proxy, pushes updates to.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public base URL, e.g. https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+# How many update deliveries Telegram may have in flight at once (1-100).
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+
+async def post_shutdown(application: Application) -> None:
+    """Releases resources shared across the bot's lifetime."""
+    await close_http_client()
 
 
 def main() -> None:
     """Initializes and runs the Telegram bot."""
-    # Create a persistence object
-    persistence = PicklePersistence(filepath="persistence.pkl")
+    # Report a misconfigured AI backend (or missing key) at startup rather
+    # than on the first message.
+    get_backend()
+
+    # Create a persistence object. Conversations saved by the old
+    # PicklePersistence are imported on the first start.
+    persistence = SQLitePersistence(
+        filepath=PERSISTENCE_DB_PATH, legacy_pickle_path="persistence.pkl"
+    )
 
     # Build the application with persistence
     application = (
-        Application.builder().token(TELEGRAM_BOT_TOKEN).persistence(persistence).build()
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .persistence(persistence)
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_shutdown(post_shutdown)
+        .build()
     )
 
     # Command and Message Handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("reprintlog", reprint_log_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text)
     )
@@ -62,8 +93,34 @@ def main() -> None:
     # A single, master callback query handler
     application.add_handler(CallbackQueryHandler(master_callback_handler))
 
-    print("Ambient Bot (refactored) is running in polling mode...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == "webhook":
+        run_webhook(application)
+    else:
+        print("Ambient Bot (refactored) is running in polling mode...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+def run_webhook(application: Application) -> None:
+    """Serves updates over a webhook; Telegram must send our secret token with each one."""
+    if not WEBHOOK_URL or not WEBHOOK_SECRET_TOKEN:
+        raise SystemExit(
+            "Webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET_TOKEN to be set."
+        )
+
+    url_path = WEBHOOK_PATH.strip("/")
+    print(
+        f"Ambient Bot (refactored) is running in webhook mode on "
+        f"{WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{url_path}..."
+    )
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=url_path,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+    )
 
 
 if __name__ == "__main__":
@@ -1,5 +1,4 @@
 import datetime
-import json
 import os
 import base64
 import mimetypes
@@ -21,15 +20,16 @@ from company_config import (
     TERMS_AND_CONDITIONS,
     REQUIRED_DOCUMENTS,
 )
+from log_utils import dump_debug, queue_handler, rotating_file_handler
 
 # Configure a logger for this module
 pdf_generator_logger = logging.getLogger(__name__)
 if not pdf_generator_logger.handlers:
     pdf_generator_logger.setLevel(logging.INFO)
-    file_handler = logging.FileHandler("pdf_error.log")
+    file_handler = rotating_file_handler("pdf_error.log")
     formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s")
     file_handler.setFormatter(formatter)
-    pdf_generator_logger.addHandler(file_handler)
+    pdf_generator_logger.addHandler(queue_handler(file_handler))
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -104,9 +104,7 @@ def _clean_data(data):
 
 def _prepare_template_data(quote_data):
     """Enriches the quote data with details needed for rendering."""
-    pdf_generator_logger.info(
-        "--- PDF Generator Received Data ---\n%s", json.dumps(quote_data, indent=2)
-    )
+    dump_debug(pdf_generator_logger, "--- PDF Generator Received Data ---", quote_data)
 
     # Clean the data first to remove N/As
     _clean_data(quote_data)
@@ -0,0 +1,295 @@
+# quote_models.py
+"""
+The quotation shape shared by the bot and the API.
+
+The bot builds a QuoteDraft from a chat's user_data when the quote is
+dispatched, and the API accepts the same dataclass as its request body.
+"""
+import logging
+from dataclasses import dataclass, field, fields
+from datetime import date
+from typing import List, Optional
+
+from services_config import GL_CODE_MAPPING
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GL_CODE = "501-000"
+DEFAULT_CUST_CODE = "300-C0002"
+
+# user_data keys that only drive the conversation UI (prompts, edit
+# cursors, message ids, intermediate extraction results). They are not part
+# of the quote and are discarded once it has been dispatched.
+TRANSIENT_KEYS = frozenset(
+    {
+        "awaiting_price_for_additional_service",
+        "awaiting_price_for_service",
+        "company_selection_message_id",
+        "editing_line_item_field",
+        "editing_line_item_index",
+        "editing_payment_phase_index",
+        "extracted_image_company_address",
+        "extracted_image_company_name",
+        "extracted_image_cust_contact",
+        "items_to_clarify",
+        "lorry_price",
+        "matched_customer_names",
+        "temp_editing_field",
+        "temp_service_line_items",
+    }
+)
+
+
+def parse_amount(value) -> float:
+    """Converts an amount such as '1,200.50' to a float, or 0.0 if it is not one."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", ""))
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Could not convert '{value}' to float: {e}")
+        return 0.0
+
+
+def gl_code_for(description: str) -> str:
+    """Returns the GL code whose keyword appears in the description."""
+    desc = description.lower()
+    for keyword, gl_code in GL_CODE_MAPPING.items():
+        if keyword in desc:
+            return gl_code
+    return DEFAULT_GL_CODE
+
+
+def _date_string(value) -> Optional[str]:
+    return value.strftime("%Y-%m-%d") if isinstance(value, date) else value
+
+
+@dataclass(slots=True)
+class LineItem:
+    qty: int
+    line_description: str
+    unit_price: float
+    gl_code: str = DEFAULT_GL_CODE
+
+    @classmethod
+    def from_raw(cls, item) -> Optional["LineItem"]:
+        """
+        Builds a LineItem from a user_data entry, which may use either
+        'line_description' or 'description'. Entries without one are skipped.
+        """
+        if isinstance(item, cls):
+            return item
+        if not isinstance(item, dict):
+            return None
+        desc = item.get("line_description") or item.get("description")
+        if not desc:
+            return None
+        try:
+            qty = int(item.get("qty", 1))
+        except (ValueError, TypeError):
+            qty = 1
+        return cls(
+            qty=qty,
+            line_description=desc,
+            unit_price=parse_amount(item.get("unit_price", 0)),
+            gl_code=item.get("gl_code") or gl_code_for(desc),
+        )
+
+    @classmethod
+    def from_raw_list(cls, items) -> List["LineItem"]:
+        line_items = (cls.from_raw(item) for item in items or [])
+        return [item for item in line_items if item is not None]
+
+    @property
+    def amount(self) -> float:
+        return self.qty * self.unit_price
+
+
+@dataclass(slots=True)
+class PaymentPhase:
+    name: str
+    amount: float
+    remarks: Optional[str] = None
+
+    @classmethod
+    def from_raw(cls, phase) -> "PaymentPhase":
+        if isinstance(phase, cls):
+            return phase
+        return cls(
+            name=phase.get("name", ""),
+            amount=parse_amount(phase.get("amount", 0)),
+            remarks=phase.get("remarks"),
+        )
+
+
+@dataclass(slots=True)
+class QuoteDraft:
+    type: str
+    cust_code: str
+    cust_name: str
+    truck_number: str
+    issuing_company: str
+    doc_no: str
+    description: str
+    total_amount: float
+    company_address: Optional[str] = None
+    cust_contact: Optional[str] = None
+    body: Optional[str] = None
+    salesperson: Optional[str] = None
+    line_items: List[LineItem] = field(default_factory=list)
+    service_line_items: List[LineItem] = field(default_factory=list)
+    excluded_line_items: List[LineItem] = field(default_factory=list)
+    included_services: List[str] = field(default_factory=list)
+    payment_phases: List[PaymentPhase] = field(default_factory=list)
+    is_proforma: bool = False
+
+    # Rental specific fields
+    main_rental_item: Optional[LineItem] = None
+    rental_period_type: Optional[str] = None
+    contract_period: Optional[str] = None
+    rental_start_date: Optional[str] = None
+    rental_end_date: Optional[str] = None
+    rental_amount: Optional[float] = None
+    deposit_condition: Optional[str] = None
+    deposit_amount: Optional[float] = None
+    security_deposit: Optional[float] = None
+    upfront_rental: Optional[float] = None
+    road_tax_amount: Optional[float] = None
+    insurance_amount: Optional[float] = None
+    sticker_amount: Optional[float] = None
+    agreement_fee: Optional[float] = None
+    selected_equipment: Optional[List[str]] = None
+
+    @classmethod
+    def from_user_data(
+        cls,
+        data: dict,
+        doc_no: str,
+        description: str,
+        issuing_company: str,
+        is_proforma: bool = False,
+    ) -> "QuoteDraft":
+        """Builds the quote from a chat's user_data, normalizing its line items."""
+        doc_type = data.get("doc_type", "none")
+        company_address = data.get("company_address", "")
+        draft = cls(
+            type=doc_type,
+            cust_code=DEFAULT_CUST_CODE,
+            cust_name=data.get("company_name", "CASH SALE"),
+            company_address="\n".join(
+                line.strip() for line in company_address.split("\n") if line.strip()
+            ),
+            cust_contact=data.get("cust_contact", ""),
+            truck_number=data.get("truck_number", ""),
+            issuing_company=issuing_company,
+            doc_no=doc_no,
+            description=description,
+            salesperson=data.get("salesperson"),
+            body=data.get("body", ""),
+            line_items=LineItem.from_raw_list(data.get("line_items")),
+            service_line_items=LineItem.from_raw_list(data.get("service_line_items")),
+            excluded_line_items=LineItem.from_raw_list(
+                data.get("excluded_line_items")
+            ),
+            payment_phases=[
+                PaymentPhase.from_raw(phase) for phase in data.get("payment_phases", [])
+            ],
+            is_proforma=is_proforma,
+            total_amount=0.0,
+        )
+        total_amount = sum(item.amount for item in draft.line_items)
+        total_amount += sum(item.amount for item in draft.service_line_items)
+
+        if doc_type.startswith("rental"):
+            if "rental_amount" in data:
+                rental_desc = "Monthly Rental"
+                if data.get("rental_period_type") == "daily":
+                    days = data.get("rental_days", "N/A")
+                    start_date = data.get("rental_start_date", "N/A")
+                    end_date = data.get("rental_end_date", "N/A")
+                    rental_desc = f"{start_date} to {end_date} ({days} Days)"
+
+                rental_amount = parse_amount(data.get("rental_amount", 0))
+                draft.main_rental_item = LineItem(
+                    qty=1,
+                    line_description=rental_desc,
+                    unit_price=rental_amount,
+                    gl_code="535-000",
+                )
+                draft.security_deposit = parse_amount(data.get("security_deposit", 0))
+                total_amount += rental_amount + draft.security_deposit
+
+            draft.rental_period_type = data.get("rental_period_type", "monthly")
+            draft.contract_period = data.get("contract_period")
+            draft.rental_start_date = _date_string(data.get("rental_start_date"))
+            draft.rental_end_date = _date_string(data.get("rental_end_date"))
+            draft.selected_equipment = data.get("selected_equipment", [])
+
+        draft.total_amount = total_amount
+        return draft
+
+
+# --- Extraction schemas ---
+# Response schemas (Gemini's OpenAPI subset) for the details the AI extracts
+# into user_data, so the model returns JSON of exactly this shape.
+
+DOC_TYPES = ("sales", "rental", "refurbish")
+_EXTRACTED_TEXT_FIELDS = (
+    "truck_number",
+    "company_name",
+    "company_address",
+    "cust_contact",
+    "body",
+    "salesperson",
+    "contract_period",
+)
+_EXTRACTED_AMOUNT_FIELDS = (
+    "rental_amount",
+    "security_deposit",
+    "road_tax_amount",
+    "insurance_amount",
+    "sticker_amount",
+    "agreement_amount",
+    "puspakom_amount",
+)
+_JSON_TYPES = {int: "integer", float: "number", str: "string"}
+
+
+def _enum(values) -> dict:
+    return {"type": "string", "format": "enum", "enum": list(values), "nullable": True}
+
+
+def _line_item_schema() -> dict:
+    """Built from LineItem's fields; gl_code is looked up locally, not extracted."""
+    properties = {
+        f.name: {"type": _JSON_TYPES[f.type]}
+        for f in fields(LineItem)
+        if f.name != "gl_code"
+    }
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+LINE_ITEMS_SCHEMA = {"type": "array", "items": _line_item_schema()}
+
+QUOTE_DETAILS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "doc_type": _enum(DOC_TYPES),
+        **{
+            name: {"type": "string", "nullable": True}
+            for name in _EXTRACTED_TEXT_FIELDS
+        },
+        "rental_period_type": _enum(("monthly", "daily")),
+        **{
+            name: {"type": "number", "nullable": True}
+            for name in _EXTRACTED_AMOUNT_FIELDS
+        },
+        "line_items": LINE_ITEMS_SCHEMA,
+    },
+}
+
+
+def discard_transient(user_data: dict) -> None:
+    """Removes the conversation-only keys listed in TRANSIENT_KEYS."""
+    for key in TRANSIENT_KEYS.intersection(user_data):
+        del user_data[key]
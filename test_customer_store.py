@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from customer_store import CustomerStore
+from quote_models import QuoteDraft
+
+
+def test_search_ranks_closest_name_first(tmp_path):
+    store = CustomerStore(str(tmp_path / "customers.sqlite3"))
+    store.upsert("ABC Logistics Sdn Bhd", "1, Jalan ABC", "012-3456789")
+    store.upsert("ABD Logistics Sdn Bhd", "2, Jalan ABD", "012-9876543")
+    store.upsert("Ali Trading", "3, Jalan Ali", "013-1112222")
+
+    matches = store.search("abc logistics")
+    assert matches[0]["name"] == "ABC Logistics Sdn Bhd"
+    assert matches[0]["address"] == "1, Jalan ABC"
+    assert "Ali Trading" not in [match["name"] for match in matches]
+
+
+def test_customer_without_address_can_be_dispatched(tmp_path):
+    csv_path = tmp_path / "customers.csv"
+    csv_path.write_text("name\nXYZ Trading Sdn Bhd\n", encoding="utf-8")
+    store = CustomerStore(str(tmp_path / "customers.sqlite3"))
+    assert store.import_csv(str(csv_path)) == 1
+
+    match = store.search("XYZ Trading")[0]
+    assert match["address"] == ""
+    assert match["contact"] == ""
+
+    draft = QuoteDraft.from_user_data(
+        {
+            "company_name": match["name"],
+            "company_address": match["address"],
+            "cust_contact": match["contact"],
+        },
+        doc_no="TEST-001",
+        description="Test",
+        issuing_company="UNIQUE ENTERPRISE",
+    )
+    assert draft.company_address == ""
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot import extraction_cache
+from bot.extraction_cache import ExtractionCache, extractor_version, text_key
+
+
+def test_text_key_ignores_case_and_spacing():
+    assert text_key("VAN 5222  ABC Sdn Bhd") == text_key("van 5222 abc sdn bhd\n")
+    assert text_key("VAN 5222") != text_key("VAN 5223")
+
+
+def test_version_follows_prompt_and_schema():
+    async def old_extractor(text):
+        return f"Extract the truck number from: {text}"
+
+    async def new_extractor(text):
+        return f"Extract the truck number and company from: {text}"
+
+    schema = {"type": "object"}
+    assert extractor_version(old_extractor, schema) == extractor_version(
+        old_extractor, {"type": "object"}
+    )
+    assert extractor_version(old_extractor, schema) != extractor_version(
+        new_extractor, schema
+    )
+    assert extractor_version(old_extractor, schema) != extractor_version(
+        old_extractor, {"type": "array"}
+    )
+
+
+def test_cached_results_are_reused_per_version(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(extraction_cache, "_cache", cache)
+    calls = []
+
+    def extractor(schema):
+        @extraction_cache.cached_extraction("text", text_key, schema)
+        async def extract(text):
+            calls.append(text)
+            return {"truck_number": text}
+
+        return extract
+
+    assert asyncio.run(extractor({"v": 1})("VAN 5222")) == {"truck_number": "VAN 5222"}
+    asyncio.run(extractor({"v": 1})("van 5222"))
+    assert calls == ["VAN 5222"]
+    # A changed schema does not reuse the old result.
+    asyncio.run(extractor({"v": 2})("VAN 5222"))
+    assert calls == ["VAN 5222", "VAN 5222"]
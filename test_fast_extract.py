@@ -0,0 +1,75 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot.fast_extract import FAST_EXTRACT_MIN_CONFIDENCE, fast_extract
+
+
+def test_sales_example_is_extracted_locally():
+    result = fast_extract("sales VAN 5222 ABC Sdn Bhd 012-3456789 RM85000")
+    assert result.details == {
+        "doc_type": "sales",
+        "truck_number": "VAN 5222",
+        "company_name": "ABC Sdn Bhd",
+        "cust_contact": "012-3456789",
+        "lorry_price": 85000.0,
+    }
+    assert result.confidence >= FAST_EXTRACT_MIN_CONFIDENCE
+
+
+def test_doc_type_chosen_by_the_user():
+    # The handler strips the doc-type keyword before calling the extractor.
+    result = fast_extract(" VAN 5222 ABC Sdn Bhd 012-3456789", "sales")
+    assert result.details["company_name"] == "ABC Sdn Bhd"
+    assert result.confidence == 1.0
+
+
+def test_name_stops_at_verbs_and_prepositions():
+    result = fast_extract("I SELL VAN 5222 TO ABC SDN BHD")
+    assert result.details["company_name"] == "ABC SDN BHD"
+    assert result.details["truck_number"] == "VAN 5222"
+    # "I" and "TO" are not explained.
+    assert result.confidence < FAST_EXTRACT_MIN_CONFIDENCE
+
+
+def test_rental_period_and_amount():
+    result = fast_extract(
+        "rental VAN 5222 for 12 months RM 3000 to XYZ Logistics"
+    )
+    assert result.details["company_name"] == "XYZ Logistics"
+    assert result.details["contract_period"] == "12 Months"
+    assert result.details["rental_amount"] == 3000.0
+
+
+def test_free_text_goes_to_gemini():
+    result = fast_extract("Please quote for JKR 5 tonne lorry for Ali Trading")
+    assert result.details["company_name"] == "Ali Trading"
+    assert result.confidence < FAST_EXTRACT_MIN_CONFIDENCE
+
+
+def test_name_with_several_suffixes():
+    result = fast_extract("VAN 5222 Syarikat Tan & Sons Trading Sdn. Bhd. 0123456789")
+    assert result.details["company_name"] == "Syarikat Tan & Sons Trading Sdn. Bhd."
+    assert result.confidence == 1.0
+
+
+def test_refurbish_line_items():
+    result = fast_extract(
+        "refurbish WXY 1234\nRepair box RM 1000\nPaint RM 500\nAli Trading"
+    )
+    assert [item["line_description"] for item in result.details["line_items"]] == [
+        "Repair box",
+        "Paint",
+    ]
+    assert result.details["company_name"] == "Ali Trading"
+    assert result.confidence == 1.0
+
+
+def test_unclear_prices_go_to_gemini():
+    result = fast_extract("VAN 5222 ABC Sdn Bhd RM 1000 RM 2000")
+    assert result.confidence == 0.0
+
+
+def test_nothing_recognised():
+    assert fast_extract("hello there").confidence == 0.0
@@ -0,0 +1,102 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from bot import flow
+from bot.logic import _STEP_ACTIONS
+
+CUSTOMER = {
+    "company_name": "ABC Sdn Bhd",
+    "customer_checked": True,
+    "company_address": "1, Jalan ABC, Kuala Lumpur",
+    "cust_contact": "012-3456789",
+    "salesperson": "Ali",
+    "truck_number": "VAN 5222",
+    "body": "Wooden Cargo",
+    "issuing_company": "UNIQUE ENTERPRISE",
+}
+
+
+@pytest.mark.parametrize("doc_type", [None, *flow.FLOWS])
+def test_every_action_has_a_handler(doc_type):
+    for step in flow.steps_for(doc_type):
+        if step.action is not None:
+            assert step.action in _STEP_ACTIONS, step.name
+
+
+def test_doc_type_comes_first():
+    assert flow.next_step({}).name == "doc_type"
+
+
+def test_missing_field_step():
+    data = {**CUSTOMER, "doc_type": "sales"}
+    del data["cust_contact"]
+    step = flow.next_step(data)
+    assert step.action == "missing_field"
+    assert step.field == "cust_contact"
+
+
+def test_na_counts_as_provided():
+    data = {**CUSTOMER, "doc_type": "sales", "cust_contact": "N/A"}
+    assert flow.next_step(data).name == "lorry_sale_type"
+
+
+def test_sales_flow_order():
+    data = {**CUSTOMER, "doc_type": "sales"}
+    names = []
+    flags = {
+        "lorry_sale_type": "lorry_sale_item_created",
+        "main_services": "main_services_done",
+        "additional_services": "additional_services_done",
+        "payment_phases": "payment_phases_complete",
+    }
+    while (step := flow.next_step(data)) is not None:
+        names.append(step.name)
+        data[flags[step.name]] = True
+    assert names == list(flags)
+
+
+def test_proforma_uses_the_base_flow():
+    assert flow.steps_for("sales_proforma") is flow.FLOWS["sales"]
+
+
+def test_rental_resolves_collected_flag():
+    data = {
+        **CUSTOMER,
+        "doc_type": "rental",
+        "rental_period_type": "monthly",
+        "contract_period": "1 Year",
+        "rental_amount": 3000,
+        "security_deposit": 6000,
+    }
+    assert flow.next_step(data).name == "rental_fees"
+    assert data["rental_details_collected"] is True
+
+
+def test_refurbish_uses_image_company_name():
+    data = {
+        **CUSTOMER,
+        "doc_type": "refurbish",
+        "company_name": None,
+        "is_company_name_from_image_extracted": True,
+        "extracted_image_company_name": "XYZ Trading",
+        "extracted_image_company_address": "2, Jalan XYZ",
+    }
+    data.pop("customer_checked")
+    step = flow.next_step(data)
+    assert data["company_name"] == "XYZ Trading"
+    assert data["company_address"] == "2, Jalan XYZ"
+    assert step.name == "customer_lookup"
+
+
+def test_sales_asks_to_confirm_image_company_name():
+    data = {
+        **CUSTOMER,
+        "doc_type": "sales",
+        "is_company_name_from_image_extracted": True,
+        "extracted_image_company_name": "XYZ Trading",
+    }
+    assert flow.next_step(data).action == "confirm_company_name"
@@ -0,0 +1,115 @@
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import log_utils
+
+
+class _ThreadRecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.done = threading.Event()
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.done.set()
+
+
+class _RenderedOn:
+    """Remembers which thread turned it into a string."""
+
+    def __init__(self):
+        self.threads = []
+
+    def __str__(self):
+        self.threads.append(threading.current_thread())
+        return "dump"
+
+
+def test_queue_handler_formats_on_the_listener_thread():
+    target = _ThreadRecordingHandler()
+    handler = log_utils.queue_handler(target)
+    logger = logging.getLogger("test_log_utils.queue")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        arg = _RenderedOn()
+        logger.warning("payload: %s", arg)
+        assert target.done.wait(5)
+    finally:
+        logger.removeHandler(handler)
+        log_utils.stop_queue_logging()
+
+    assert target.messages == ["payload: dump"]
+    assert arg.threads and threading.main_thread() not in arg.threads
+
+
+def _write_log(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+
+def test_tail_continues_into_rotated_files(tmp_path):
+    path = str(tmp_path / "bot.log")
+    _write_log(path + ".2", ["2024-05-01 10:00:00,000 - oldest"])
+    _write_log(
+        path + ".1",
+        ["2024-05-02 10:00:00,000 - older", "2024-05-02 11:00:00,000 - traceback"],
+    )
+    # The first line continues the record that ended the previous file.
+    _write_log(path, ["  File x, line 1", "2024-05-03 10:00:00,000 - newest"])
+
+    assert log_utils.tail_log_records(path, limit=2) == [
+        "2024-05-02 11:00:00,000 - traceback\n  File x, line 1",
+        "2024-05-03 10:00:00,000 - newest",
+    ]
+    assert len(log_utils.tail_log_records(path)) == 4
+
+    since = datetime(2024, 5, 2)
+    records = log_utils.tail_log_records(path, since=since, contains=["older"])
+    assert records == ["2024-05-02 10:00:00,000 - older"]
+
+
+def test_tail_reads_timed_rotation_newest_first(tmp_path):
+    path = str(tmp_path / "bot.log")
+    _write_log(path + ".2024-05-01", ["2024-05-01 10:00:00,000 - first"])
+    _write_log(path + ".2024-05-02", ["2024-05-02 10:00:00,000 - second"])
+    _write_log(path, ["2024-05-03 10:00:00,000 - third"])
+
+    assert log_utils.tail_log_records(path) == [
+        "2024-05-01 10:00:00,000 - first",
+        "2024-05-02 10:00:00,000 - second",
+        "2024-05-03 10:00:00,000 - third",
+    ]
+
+
+def test_dump_shows_the_object_as_it_was_logged():
+    target = _ThreadRecordingHandler()
+    handler = log_utils.queue_handler(target)
+    logger = logging.getLogger("test_log_utils.dump")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    try:
+        data = {"doc_type": "sales"}
+        log_utils.dump_debug(logger, "dump:", data, level=logging.INFO, sample_rate=1)
+        data.clear()
+        assert target.done.wait(5)
+    finally:
+        logger.removeHandler(handler)
+        log_utils.stop_queue_logging()
+
+    assert target.messages == ['dump:\n{\n  "doc_type": "sales"\n}']
+
+
+def test_lazy_dump_survives_any_error():
+    class Broken:
+        def __str__(self):
+            raise RuntimeError("dictionary changed size during iteration")
+
+    assert str(log_utils.LazyDump([Broken()])).startswith("<unserializable")
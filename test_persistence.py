@@ -0,0 +1,58 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot.persistence import SQLitePersistence
+
+
+class SlowWritePersistence(SQLitePersistence):
+    """Holds every write on the worker thread for a moment."""
+
+    def _write_rows(self, rows):
+        time.sleep(0.2)
+        super()._write_rows(rows)
+
+
+def _count_users(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM user_data").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_flush_during_write_keeps_rows(tmp_path):
+    path = str(tmp_path / "persistence.sqlite3")
+
+    async def run():
+        persistence = SlowWritePersistence(path, flush_interval=60, flush_threshold=1)
+        await persistence.update_user_data(1, {"step": "awaiting_truck"})
+        # Let the flush loop start writing the first row.
+        await asyncio.sleep(0.05)
+        await persistence.flush()
+
+    asyncio.run(run())
+    assert _count_users(path) == 1
+
+
+def test_rows_are_read_back_after_flush(tmp_path):
+    path = str(tmp_path / "persistence.sqlite3")
+
+    async def write():
+        persistence = SQLitePersistence(path, flush_interval=60)
+        await persistence.update_user_data(1, {"doc_type": "sales"})
+        await persistence.flush()
+
+    async def read():
+        persistence = SQLitePersistence(path)
+        user_data = {}
+        await persistence.refresh_user_data(1, user_data)
+        await persistence.flush()
+        return user_data
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == {"doc_type": "sales"}
@@ -0,0 +1,33 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot import prefetch
+
+
+async def _lookup(name):
+    return {"name": name}
+
+
+def test_consume_uses_the_prefetched_result():
+    async def run():
+        prefetch.prefetch(1, "customer", "abc", _lookup, "ABC")
+        return await prefetch.consume(1, "customer", "abc", _lookup, "other")
+
+    assert asyncio.run(run()) == {"name": "ABC"}
+    assert 1 not in prefetch._tasks
+
+
+def test_old_lookups_are_pruned(monkeypatch):
+    async def run():
+        prefetch.prefetch(1, "customer", "abc", _lookup, "ABC")
+        await asyncio.sleep(0)
+        monkeypatch.setattr(prefetch, "PREFETCH_MAX_AGE", -1)
+        prefetch.prefetch(2, "customer", "xyz", _lookup, "XYZ")
+        assert 1 not in prefetch._tasks
+        prefetch.discard(2)
+
+    asyncio.run(run())
+    assert prefetch._tasks == {}
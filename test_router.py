@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from bot.router import CallbackRouter
+
+
+def _router():
+    router = CallbackRouter("test")
+
+    @router.route("edit_")
+    async def edit(update, context):
+        context.append("edit")
+
+    @router.route("edit_line_item_")
+    async def edit_line_item(update, context):
+        context.append("edit_line_item")
+
+    @router.route(exact="edit_done")
+    async def edit_done(update, context):
+        context.append("edit_done")
+
+    return router
+
+
+def test_exact_match_wins():
+    route, handler = _router().resolve("edit_done")
+    assert route == "edit_done"
+    assert handler.__name__ == "edit_done"
+
+
+def test_longest_prefix_wins():
+    router = _router()
+    assert router.resolve("edit_line_item_2")[0] == "edit_line_item_"
+    assert router.resolve("edit_truck_number")[0] == "edit_"
+    assert router.resolve("edit_line")[0] == "edit_"
+
+
+def test_no_match():
+    router = _router()
+    assert router.resolve("review_correct") == (None, None)
+    assert router.resolve("edit") == (None, None)
+    assert router.resolve("") == (None, None)
+
+
+def test_duplicate_routes_are_rejected():
+    router = _router()
+    with pytest.raises(ValueError):
+        router.route("edit_")(lambda update, context: None)
+    with pytest.raises(ValueError):
+        router.route(exact="edit_done")(lambda update, context: None)
+    with pytest.raises(ValueError):
+        router.route("")(lambda update, context: None)
+
+
+def test_dispatch():
+    router = _router()
+    calls = []
+
+    def update(data):
+        return SimpleNamespace(callback_query=SimpleNamespace(data=data))
+
+    assert asyncio.run(router.dispatch(update("edit_line_item_0"), calls))
+    assert not asyncio.run(router.dispatch(update("unknown"), calls))
+    assert calls == ["edit_line_item"]
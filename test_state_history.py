@@ -0,0 +1,69 @@
+import copy
+import os
+import pickle
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from bot.state_history import StateHistory, get_state_history
+
+
+def test_keeps_the_most_recent_states():
+    history = StateHistory(range(10), capacity=4)
+    assert list(history) == [6, 7, 8, 9]
+    assert len(history) == 4
+    assert history[0] == 6
+    assert history[-1] == 9
+
+
+def test_index_out_of_range():
+    history = StateHistory([1, 2], capacity=4)
+    with pytest.raises(IndexError):
+        history[2]
+    with pytest.raises(IndexError):
+        history[-3]
+
+
+def test_push_skips_repeats():
+    history = StateHistory(capacity=4)
+    history.push(1)
+    history.push(1)
+    history.push(2)
+    assert list(history) == [1, 2]
+
+
+def test_pop_after_wrapping():
+    history = StateHistory([1, 2, 3, 4, 5], capacity=3)
+    assert history.pop() == 5
+    history.append(6)
+    assert list(history) == [3, 4, 6]
+    assert [history.pop() for _ in range(3)] == [6, 4, 3]
+    with pytest.raises(IndexError):
+        history.pop()
+
+
+def test_none_state():
+    history = StateHistory([None, 3])
+    assert list(history) == [None, 3]
+
+
+@pytest.mark.parametrize(
+    "copier", [copy.deepcopy, lambda history: pickle.loads(pickle.dumps(history))]
+)
+def test_copies_keep_order_and_capacity(copier):
+    history = StateHistory(range(7), capacity=5)
+    copied = copier(history)
+    assert list(copied) == list(history)
+    assert copied.capacity == 5
+    copied.append(9)
+    assert list(history) == [2, 3, 4, 5, 6]
+
+
+def test_legacy_list_is_converted():
+    user_data = {"state_history": [1, 2, 3]}
+    history = get_state_history(user_data)
+    assert isinstance(user_data["state_history"], StateHistory)
+    assert list(history) == [1, 2, 3]
+    assert get_state_history(user_data) is history